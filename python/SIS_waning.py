@@ -24,9 +24,145 @@ default_pars = sc.objdict(
     seed = 1, # Random seed to use
     colors = sc.objdict(S='darkgreen', I='gold', R='skyblue'),
     save_movie = False, # Whether to save the movie (slow)
+    save_full = True, # Whether to store which agents are S and I at every time point
 )
 
-class Person(scctobj):
+def find_neighbours(x, y, radius, inner=0, max_pairs=None):
+    """
+    Find all ordered pairs of distinct points at least inner and less than radius apart
+
+    Points (in the unit square) are binned into a grid of cells about radius/2
+    wide, so only the block of cells within radius of each point's cell has to be
+    searched, skipping the cells that lie wholly within inner. The pairs are
+    yielded as (p1, p2, d) arrays in chunks of source points, each chunk searching
+    at most max_pairs candidate pairs (and at least one point), so memory is
+    bounded however many pairs there are in total.
+    """
+    N = len(x)
+    n_cells = max(1, int(2/radius))
+    cx = np.minimum((x*n_cells).astype(int), n_cells-1)
+    cy = np.minimum((y*n_cells).astype(int), n_cells-1)
+    order = np.argsort(cx*n_cells + cy, kind='stable') # Work in cell order so that neighbours are close in memory
+    xs, ys, cx, cy = x[order], y[order], cx[order], cy[order]
+    cell_ids = np.arange(n_cells**2)
+    starts = np.searchsorted(cx*n_cells + cy, cell_ids, side='left')
+    ends = np.searchsorted(cx*n_cells + cy, cell_ids, side='right')
+
+    # Cell offsets that can hold points in range, from the closest and furthest points of two cells
+    reach = min(int(np.ceil(radius*n_cells)), n_cells-1)
+    offsets = []
+    for dx in range(-reach, reach+1):
+        for dy in range(-reach, reach+1):
+            dmin = ((max(abs(dx)-1, 0))**2 + (max(abs(dy)-1, 0))**2)**0.5/n_cells
+            dmax = ((abs(dx)+1)**2 + (abs(dy)+1)**2)**0.5/n_cells
+            if dmin < radius and dmax >= inner:
+                offsets.append((dx, dy))
+
+    def neighbour_cells(i0, i1):
+        """ Start and size of each neighbouring cell of points i0 to i1 """
+        nstarts = np.zeros((len(offsets), i1-i0), dtype=int)
+        ncounts = np.zeros((len(offsets), i1-i0), dtype=int)
+        for k, (dx, dy) in enumerate(offsets):
+            nx = cx[i0:i1] + dx
+            ny = cy[i0:i1] + dy
+            valid = (nx >= 0) & (nx < n_cells) & (ny >= 0) & (ny < n_cells)
+            ncell = np.where(valid, nx*n_cells + ny, 0)
+            nstarts[k] = starts[ncell]
+            ncounts[k] = np.where(valid, ends[ncell] - starts[ncell], 0)
+        return nstarts, ncounts
+
+    # Split the points into chunks of at most max_pairs candidate pairs
+    if max_pairs is None or not N:
+        bounds = [0, N]
+    else:
+        total = np.zeros(N, dtype=int)
+        for i0 in range(0, N, max(1, max_pairs//len(offsets))):
+            i1 = min(i0 + max(1, max_pairs//len(offsets)), N)
+            total[i0:i1] = neighbour_cells(i0, i1)[1].sum(axis=0)
+        total = np.cumsum(total)
+        bounds = [0]
+        while bounds[-1] < N:
+            done = total[bounds[-1]-1] if bounds[-1] else 0
+            bounds.append(max(bounds[-1]+1, int(np.searchsorted(total, done + max_pairs, side='right'))))
+
+    for i0, i1 in zip(bounds[:-1], bounds[1:]):
+        nstarts, ncounts = neighbour_cells(i0, i1)
+        counts = ncounts.ravel()
+        offs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        p1 = np.repeat(np.tile(np.arange(i0, i1), len(offsets)), counts)
+        p2 = np.repeat(nstarts.ravel(), counts) + offs
+        d = ((xs[p1] - xs[p2])**2 + (ys[p1] - ys[p2])**2)**0.5
+        keep = (p1 != p2) & (d >= inner) & (d < radius)
+        yield order[p1[keep]], order[p2[keep]], d[keep]
+
+
+def make_contacts(x, y, n_contacts, distance, max_pairs=None):
+    """
+    Pair agents who are close to each other
+
+    Each ordered pair (i,j) is given the score (1 + d_ij/distance)/u_ij, with u_ij
+    uniform on (0,1), and the N*n_contacts/2 pairs with the lowest scores become
+    contacts. A pair further apart than r always scores above 1 + r/distance, so
+    once the selected scores are all below that bound, pairs beyond r could not
+    have been chosen and only pairs within r need to be scored. The search radius
+    is grown until this holds, which gives the same distribution of contacts as
+    scoring all N^2 pairs.
+
+    Each pair is scored once, when the radius first reaches it. Pairs are searched
+    in chunks of at most max_pairs (default: one per contact), and after each chunk
+    only the pairs that can still be selected are kept, so memory is O(N*n_contacts).
+    The number of pairs scored grows somewhat faster than N, since the radius
+    needed shrinks more slowly than 1/sqrt(N).
+    """
+    N = len(x)
+    n_select = int(N*n_contacts/2)
+    if not n_select:
+        return np.zeros((0, 2), dtype=int)
+    if max_pairs is None:
+        max_pairs = n_select
+    max_radius = 1.5 # Every pair in the unit square is closer than this
+
+    p1 = np.array([], dtype=int)
+    p2 = np.array([], dtype=int)
+    scores = np.array([])
+    inner = 0
+
+    # Start from the radius that would be needed if there were no edges: scoring the
+    # pairs within r selects N*n_contacts/2 of them when r^3/(1 + r/distance) = 3*distance*n_contacts/(2*pi*N)
+    radius = 0
+    for i in range(10):
+        radius = (3*distance*n_contacts/(2*np.pi*N)*(1 + radius/distance))**(1/3)
+    radius = min(1.05*radius, max_radius) # A little more to allow for the pairs lost at the edges
+    while True:
+        for q1, q2, d in find_neighbours(x, y, radius, inner=inner, max_pairs=max_pairs):
+            q_scores = (1 + d/distance)/np.random.rand(len(d))
+            if len(scores) == n_select: # Pairs scoring above the n_select lowest so far can never be selected
+                keep = q_scores < scores.max()
+                q1, q2, q_scores = q1[keep], q2[keep], q_scores[keep]
+            p1 = np.concatenate([p1, q1])
+            p2 = np.concatenate([p2, q2])
+            scores = np.concatenate([scores, q_scores])
+            if len(scores) > n_select:
+                inds = np.argpartition(scores, n_select-1)[:n_select]
+                p1, p2, scores = p1[inds], p2[inds], scores[inds]
+
+        if len(scores) == n_select and scores.max() <= 1 + radius/distance:
+            break
+        elif radius >= max_radius: # Every pair is already a candidate
+            raise ValueError(f'Cannot make {n_select} contacts between {N} people')
+
+        # Only score the pairs the bigger radius adds; pairs beyond the radius where the
+        # bound equals the highest selected score so far can't be selected
+        inner = radius
+        radius = min(radius*1.5, max_radius)
+        if len(scores) == n_select:
+            radius = min(radius, distance*(scores.max() - 1))
+
+    inds = np.argsort(scores)
+    return np.vstack([p1[inds], p2[inds]]).T
+
+
+class Person(sc.prettyobj):
     """
     Define each person (agent) in SimpleABM
 
@@ -116,17 +252,7 @@ class Sim(sc.dictobj):
         """ Create the network by pairing agents who are close to each other """
         pars = self.pars
         x,y = self.get_xy()
-        dist = np.zeros((pars.N, pars.N))
-        for i in range(pars.N):
-            dist[i,:] = 1 + ((x - x[i])**2 + (y - y[i])**2)**0.5/self.pars.distance
-            dist[i,i] = np.inf
-
-        rnds = np.random.rand(pars.N, pars.N)
-        ratios = dist/rnds
-        order = np.argsort(ratios, axis=None)
-        inds = order[0:int(pars.N*pars.n_contacts/2)]
-        contacts = np.unravel_index(inds, ratios.shape)
-        self.contacts = np.vstack(contacts).T
+        self.contacts = make_contacts(x, y, pars.n_contacts, pars.distance)
 
     def check_infections(self, t):
         """ Check which agents become infected """
@@ -158,8 +284,9 @@ class Sim(sc.dictobj):
         self.S[t] += len(this_S)
         self.I[t] += len(this_I)
 
-        self.S_full.append(this_S)
-        self.I_full.append(this_I)
+        if self.pars.save_full:
+            self.S_full.append(this_S)
+            self.I_full.append(this_I)
 
     def run(self):
         """ Run the simulation by integrating over time """
@@ -182,6 +309,103 @@ class Sim(sc.dictobj):
         pl.xlim(left=0)
         pl.show()
 
+
+class VectorSim(Sim):
+    """
+    Array-based version of the simulation
+
+    Takes the same parameters and has the same API as Sim, but stores the agents
+    as NumPy arrays (one per attribute) instead of Person objects, so that each
+    step is a handful of vectorized operations over all agents and contacts.
+
+    Infections follow the same rules as Sim, which checks the contacts one at a
+    time: an agent infected by an earlier contact can pass the infection on
+    through a later contact in the same step. The random numbers are drawn in a
+    different order, so results match Sim in distribution but not run for run.
+    """
+
+    def initialize(self):
+        """ Initialize everything (sim can be re-initialized as well) """
+        pars = self.pars
+
+        # Initialize people and the network; x,y are drawn in the same order as for Person objects
+        np.random.seed(pars.seed)
+        self.x, self.y = np.random.rand(pars.N, 2).T
+        self.S_state = np.ones(pars.N, dtype=bool) # People start off susceptible
+        self.I_state = np.zeros(pars.N, dtype=bool)
+        self.t_I = np.full(pars.N, np.nan) # Initially no time of infection
+        self.imm = np.zeros(pars.N) # Start with no immunity
+        self.infect(np.arange(pars.I0), t=0) # Make the first I0 people infectious
+        self.make_network()
+
+        # Initial conditions
+        self.S = np.zeros(pars.npts)
+        self.I = np.zeros(pars.npts)
+        self.S_full = []
+        self.I_full = []
+
+    def get_xy(self):
+        """ Get the location of each agent """
+        return self.x, self.y
+
+    def infect(self, inds, t):
+        self.S_state[inds] = False
+        self.I_state[inds] = True
+        self.t_I[inds] = t # Record the time that an infection happens
+
+    def recover(self, inds, t):
+        self.I_state[inds] = False
+        self.S_state[inds] = True # They are susceptible again
+        self.imm[inds] = 1 # Start with perfect immunity
+
+    def check_infections(self, t):
+        """ Check which agents become infected """
+        pars = self.pars
+        p1, p2 = self.contacts[:,0], self.contacts[:,1]
+        source = np.column_stack([p2, p1]).ravel() # As in Sim, each contact checks p1 catching it from p2, then p2 from p1
+        target = np.column_stack([p1, p2]).ravel()
+        check = np.flatnonzero(self.S_state[target]) # Position of each check in the order Sim makes them
+        source, target = source[check], target[check]
+        prob = pars.beta*pars.dt*(1 - self.imm[target]) # Probability of infection is beta * dt * susceptibility
+        hit = np.random.rand(len(target)) < prob
+        source, target, check = source[hit], target[hit], check[hit]
+
+        # Find the first check at which each agent is infected; a source may itself have been infected by an earlier check
+        when = np.where(self.I_state, -1, np.inf)
+        while True:
+            active = when[source] < check
+            targets, first = np.unique(target[active], return_index=True) # Checks are in order, so the first is the earliest
+            earlier = check[active][first] < when[targets]
+            if not earlier.any():
+                break
+            when[targets[earlier]] = check[active][first][earlier]
+        infected = np.flatnonzero(~self.I_state & np.isfinite(when))
+        self.infect(infected, t)
+
+    def check_recoveries(self, t):
+        """ Check which agents recover """
+        pars = self.pars
+        inds = np.flatnonzero(self.I_state)
+        recovered = inds[np.random.rand(len(inds)) < pars.gamma*pars.dt]
+        self.recover(recovered, t)
+
+    def check_immunities(self, t):
+        """ Check how agent immunity evolves """
+        inds = np.flatnonzero(self.S_state & ~np.isnan(self.t_I)) # Susceptible and infected in the past
+        self.imm[inds] = np.exp(-(t - self.t_I[inds])/self.pars.waning_rate) # Exponential decay of waning
+
+    def count(self, t):
+        """ Count the number of agents in each state """
+        self.S[t] += np.count_nonzero(self.S_state)
+        self.I[t] += np.count_nonzero(self.I_state)
+
+        if self.pars.save_full:
+            self.S_full.append(np.flatnonzero(self.S_state))
+            self.I_full.append(np.flatnonzero(self.I_state))
+
+
+if __name__ == '__main__':
+
     # Create and run the simulation
     sim = Sim()
     sim.run()
@@ -0,0 +1,152 @@
+"""
+Agent-based sim that takes long steps between outbreaks
+
+The sim's ``dt`` is the short step used during an outbreak, e.g. a week or a day,
+which suits the measles generation time. While the share of agents exposed or
+infectious is below ``fine_prevalence``, the sim instead moves to the end of the
+current reporting period (every ``n_substeps`` timesteps) in one long step:
+
+    sim = AdaptiveSim(pars=pars, people=ppl, diseases=SEIR(), interventions=intv,
+                      start=2020, n_years=10, dt=1/48, n_substeps=4)
+    sim.run()
+    sim.report()  # Monthly results
+
+During a long step, ``sim.dt`` is the length of the whole step, so that births,
+deaths, aging and transmission cover all of it. Durations are still converted
+to timesteps of the time vector (``tick_dt()``), so an agent infected during a
+long step becomes infectious and recovers on the same timesteps as in a sim
+that only takes short steps. Events that fall inside a long step happen at the
+start of the next step, as they would on a coarser time vector. Results for the
+timesteps skipped by a long step are zero for flows (such as new infections)
+and carried forward for everything else.
+
+The compartmental engines (``compartmental.py``) have the same option, as
+``adaptive=True``.
+"""
+
+import numpy as np
+import pandas as pd
+import starsim as ss
+
+from replicates import results_keys
+
+
+def tick_dt(sim):
+    """ Length of one timestep of the sim's time vector; the same as sim.dt, except during an AdaptiveSim's long steps """
+    return getattr(sim, 'dt_tick', sim.dt)
+
+
+def step_ticks(sim):
+    """ Number of timesteps of the time vector covered by the current step """
+    return getattr(sim, 'n_ticks', 1)
+
+
+def max_step_ticks(sim):
+    """ Most timesteps of the time vector a step can cover: n_substeps for an AdaptiveSim, otherwise 1 """
+    return sim.n_substeps if isinstance(sim, AdaptiveSim) else 1
+
+
+def pop_buckets(buckets, sim):
+    """
+    Remove the per-timestep buckets of uids that have come due since the
+    previous step (just this timestep, unless the previous step was long), and
+    return their contents as a list of arrays.
+    """
+    due = []
+    for ti in range(getattr(sim, 'ti_prev', sim.ti - 1) + 1, sim.ti + 1):
+        due += buckets.pop(ti, [])
+    return due
+
+
+def is_flow(res):
+    """ Whether a result counts events during each timestep (summed over a period) rather than a state (taken at its end) """
+    return res.name == 'new' or res.name.startswith('new_') or res.name == 'incidence'
+
+
+class AdaptiveSim(ss.Sim):
+    """
+    A Sim that takes a long step to the end of each reporting period while there is no outbreak.
+
+    Args:
+        n_substeps (int): number of timesteps in each reporting period
+        fine_prevalence (float): share of living agents exposed or infectious at or above which short steps are used
+        kwargs (dict): passed to ss.Sim
+    """
+
+    def __init__(self, pars=None, n_substeps=30, fine_prevalence=1e-4, **kwargs):
+        super().__init__(pars, **kwargs)
+        self.n_substeps = n_substeps
+        self.fine_prevalence = fine_prevalence
+        self.until = None  # Long steps stop here, so that run(until=...) stops at the right timestep
+        return
+
+    def init_time_attrs(self):
+        super().init_time_attrs()
+        self.dt_tick = self.dt  # Length of a timestep of the time vector
+        self.n_ticks = 1  # Timesteps covered by the current step
+        self.ti_prev = -1  # Timestep at which the previous step started
+        return
+
+    def init_results(self):
+        super().init_results()
+        self.results += ss.Result(None, 'step_ticks', self.npts, ss.dtypes.int, scale=False, label='Timesteps per step')
+        return
+
+    def run(self, until=None, verbose=None):
+        self.until = until
+        return super().run(until=until, verbose=verbose)
+
+    def outbreak(self):
+        """ Whether the share of living agents exposed or infectious (with any disease) is at least fine_prevalence """
+        n_active = 0
+        for disease in self.diseases():
+            n_active += np.count_nonzero(disease.infected)
+            exposed = getattr(disease, 'exposed', None)
+            if exposed is not None:
+                n_active += np.count_nonzero(exposed)
+        return n_active >= self.fine_prevalence*np.count_nonzero(self.people.alive)
+
+    def step(self):
+        """ One timestep, or a long step to the end of the reporting period if there is no outbreak """
+        ti = self.ti
+        if self.outbreak():
+            n = 1
+        else:
+            stop = self.npts if self.until is None else self.until
+            n = min(self.n_substeps - ti % self.n_substeps, stop - ti)
+
+        self.n_ticks = n
+        self.dt = self.pars.dt = n*self.dt_tick
+        try:
+            super().step()
+        finally:
+            self.dt = self.pars.dt = self.dt_tick
+            self.n_ticks = 1
+        self.ti_prev = ti
+
+        if n > 1:
+            for res in self.results.flatten().values():
+                if isinstance(res, ss.Result) and not is_flow(res):
+                    res[ti+1:ti+n] = res[ti]
+            self.ti = ti + n
+            self.people.ti = self.ti
+            self.complete = self.ti == self.npts
+        self.results.step_ticks[ti] = n
+        return
+
+    def report(self, disease='seir', keys=results_keys):
+        """
+        The disease's results on the reporting grid (every n_substeps timesteps).
+        Flows such as new infections are summed over each period, and other
+        results such as prevalence are taken at its last timestep.
+
+        Returns:
+            A DataFrame with the year at the start of each period and the given results
+        """
+        starts = np.arange(0, self.npts, self.n_substeps)
+        ends = np.minimum(starts + self.n_substeps, self.npts) - 1
+        df = pd.DataFrame({'year': self.yearvec[starts]})
+        for key in keys:
+            res = self.results[disease][key]
+            df[key] = np.add.reduceat(np.asarray(res), starts) if is_flow(res) else np.asarray(res)[ends]
+        return df
@@ -0,0 +1,99 @@
+"""
+Age-based scheduling of agents
+
+Agents age by ``dt`` every timestep, so the timestep at which an agent reaches a
+given age is known as soon as the agent exists. These helpers put agents into
+per-timestep buckets when they are born (or when the sim starts), so that age
+rules only touch the agents close to the relevant age instead of scanning the
+whole population every timestep.
+"""
+
+from collections import defaultdict
+import numpy as np
+import starsim as ss
+
+from adaptive import tick_dt, pop_buckets
+
+
+class AgeCrossingSchedule:
+    """
+    Buckets of agents keyed by the timestep at which they reach a given age.
+
+    Call ``update()`` once per timestep: it schedules any agents born since the
+    previous call and returns the agents that reached the age on this timestep.
+    The predicted timestep is only used to decide when to look at an agent; the
+    agent's actual age is checked before it is returned, and agents that are not
+    quite there yet are moved to the next bucket.
+
+    Args:
+        age (float): the age (in years) being tracked
+        strict (bool): if True, an agent crosses once age > ``age``, otherwise once age >= ``age``
+    """
+
+    def __init__(self, age, strict=False):
+        self.age = age
+        self.strict = strict
+        self.buckets = defaultdict(list)
+        self.next_uid = 0  # Agents with uids below this have already been scheduled
+        return
+
+    def crossed(self, age):
+        """ Whether agents of the given ages are past the threshold """
+        return age > self.age if self.strict else age >= self.age
+
+    def add(self, sim, uids):
+        """ Schedule agents; those already past the threshold are due this timestep """
+        age = sim.people.age[uids]
+        ti_due = sim.ti + np.maximum(np.floor((self.age - age) / tick_dt(sim)), 0).astype(int)
+        order = np.argsort(ti_due, kind='stable')  # One sort rather than one scan of the agents per bucket
+        ti_due = ti_due[order]
+        keys, starts = np.unique(ti_due, return_index=True)
+        for ti, bucket in zip(keys, np.split(uids[order], starts[1:])):
+            self.buckets[ti].append(bucket)
+        return
+
+    def update(self, sim):
+        """ Schedule new agents and return the uids that reached the age this timestep """
+        auids = sim.people.auids
+        new_uids = auids[np.searchsorted(auids, self.next_uid):]
+        if len(new_uids):
+            self.next_uid = new_uids[-1] + 1
+            self.add(sim, new_uids)
+
+        due = pop_buckets(self.buckets, sim)
+        if not due:
+            return ss.uids()
+        due = ss.uids(np.concatenate(due))
+        due = due[sim.people.alive[due]]
+
+        crossed = self.crossed(sim.people.age[due])
+        if not crossed.all():
+            self.buckets[sim.ti + 1].append(due[~crossed])
+        return due[crossed]
+
+
+class AgeWindowIndex:
+    """
+    The set of living agents whose age is in [age_min, age_max].
+
+    Agents join when they reach ``age_min`` and are dropped once they are older
+    than ``age_max`` or have died, so each call to ``update()`` only touches the
+    agents currently in the window plus those entering it.
+
+    Args:
+        age_min (float): youngest age in the window (years)
+        age_max (float): oldest age in the window (years)
+    """
+
+    def __init__(self, age_min, age_max):
+        self.entering = AgeCrossingSchedule(age_min)
+        self.age_max = age_max
+        self.uids = ss.uids()
+        return
+
+    def update(self, sim):
+        """ Update the window for this timestep and return the (sorted) uids in it """
+        uids = ss.uids(np.union1d(self.uids, self.entering.update(sim)))
+        keep = sim.people.alive[uids] & (sim.people.age[uids] <= self.age_max)
+        self.uids = uids[keep]
+        return self.uids
@@ -6,6 +6,7 @@ import starsim as ss
 from plotnine import *
 import pandas as pd
 import matplotlib.pyplot as plt
+from vaccination import measles_vaccine, measles_routine_vx
 
 
 # Data
@@ -28,7 +29,7 @@ class SEIR(ss.Infection):
         self.default_pars(
             beta = 18/9 ,  # Mean transmission rate: R0 / D
             init_prev = ss.bernoulli(p=0.005),
-            init_immune = ss.bernoulli(p=0.01)
+            init_immune = ss.bernoulli(p=0.01),
             dur_exp = ss.lognorm_ex(mean=10/12, stdev=2),
             dur_inf = ss.lognorm_ex(mean=9/12, stdev=2),
             p_death = ss.bernoulli(p=0.018)
@@ -50,11 +51,10 @@ class SEIR(ss.Infection):
     def infectious(self):
         return self.infected
       
-     def set_initial_states(self, sim):
-        super().set_initial_states(sim)
-        imm_prob = self.pars.imm_prob
-        alive_uids = ss.true(sim.people.alive & self.susceptible)
-        initially_immune = imm_prob > np.random.rand()
+    def init_post(self):
+        """ Seed the initial infections, then make some of the remaining susceptibles immune """
+        super().init_post()
+        initially_immune = self.pars.init_immune.filter(self.susceptible.uids)
 
         self.susceptible[initially_immune] = False
         self.recovered[initially_immune] = True
@@ -133,18 +133,29 @@ class SEIR(ss.Infection):
         self.recovered[uids] = False
         return
       
+    def init_results(self):
+        """ Add incidence to the default results, and reset the running totals """
+        super().init_results()
+        self.results += ss.Result(self.name, 'incidence', self.sim.npts, dtype=float, scale=False, label='Incidence per 1,000')
+        self.cum_total = 0
+        return
+
     def update_results(self):
-        super().update_results()
+        # Skip ss.Infection.update_results, which rescans the result history for cum_infections
+        ss.Disease.update_results(self)
         res = self.results
         ti = self.sim.ti
+        n_alive = np.count_nonzero(self.sim.people.alive)
         
         # Count the number of new exposures during this timestep
         new_exposures = np.count_nonzero((self.ti_exposed == ti) & self.exposed)
+        self.cum_total += new_exposures
         
         # Update results accordingly
         res.new_infections[ti] = new_exposures
-        res.cum_infections[ti] = np.sum(res['new_infections'][:ti+1])
-        res.prevalence[ti] = (res.n_infected[ti] + res.n_exposed[ti]) / np.count_nonzero(self.sim.people.alive)
+        res.cum_infections[ti] = self.cum_total
+        res.prevalence[ti] = (res.n_infected[ti] + res.n_exposed[ti]) / n_alive
+        res.incidence[ti] = new_exposures / n_alive * 1000
         return
 
     def plot(self, plot_kw=None):
@@ -159,7 +170,6 @@ class SEIR(ss.Infection):
         sc.boxoff()
         sc.commaticks()
         return fig
-measles = SEIR()
 
 # Interventions -------------------------------------------------------------------------------------------
 
@@ -195,29 +205,25 @@ pars = dict(
     networks = ss.RandomNet(pars={'n_contacts': 4})
 )
 
-ppl = ss.People(
-    n_agents = 30_000,     # Number of agents to simulate
-    age_data = pop_age
-   
-    )
-
 # Simulations -------------------------------------------------------------------------------------------
 
+# Each sim gets its own people, disease and network, but the same seed: every draw comes from a
+# per-purpose stream keyed by agent, so the two runs only differ where the interventions act
 mysim = ss.Sim(
-    pars = pars,
+    pars = sc.dcp(pars),
     start = 2020, 
-    people = ppl, 
-    diseases = measles, 
+    people = ss.People(n_agents=30_000, age_data=pop_age), 
+    diseases = SEIR(), 
     rand_seed = 765,
     n_years = 20,
     dt = 1/12
 )
 
 mysim_Intv = ss.Sim(
-    pars = pars,
+    pars = sc.dcp(pars),
     start = 2020, 
-    people = ppl, 
-    diseases = measles, 
+    people = ss.People(n_agents=30_000, age_data=pop_age), 
+    diseases = SEIR(), 
     interventions = intv,
     rand_seed = 765,
     n_years = 20,
@@ -259,8 +265,8 @@ res2_long = pd.melt(res2, id_vars=['year'], var_name='state', value_name='count'
 
 # Age at vaccination
 age_vaccinated = pd.DataFrame({
-    "age_mcv1": mysim_Intv.interventions.routine1.age_at_vaccination*12,
-    "age_mcv2" : mysim_Intv.interventions.routine2.age_at_vaccination*12
+    "age_mcv1": mysim_Intv.people.doses.age_dose1*12,
+    "age_mcv2" : mysim_Intv.people.doses.age_dose2*12
     
     })
 
@@ -293,4 +299,4 @@ age_vaccinated = pd.DataFrame({
   geom_histogram()
 )
 
-mysim_Intv.interventions.routine2.n_doses.max()
+mysim_Intv.people.doses.n_doses.max()
@@ -0,0 +1,139 @@
+"""
+Benchmark the measles SEIR model
+
+Runs the standard scenarios (baseline, MCV1+MCV2, MCV1+MCV2+SIA) at several
+population sizes and timesteps, and writes the throughput (agent-steps per
+second), peak memory and time spent in each part of the model to a JSON file
+that can be compared across commits:
+
+    python benchmark.py --sizes 10000 100000 --out bench.json
+
+Each case runs in a fresh process so that peak RSS is measured per case.
+"""
+
+import sys
+import json
+import argparse
+import resource
+import subprocess
+import multiprocessing as mp
+import concurrent.futures as cf
+import numpy as np
+import sciris as sc
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx, measles_campaign_vx
+from profiling import SimProfiler
+
+scenarios = ['baseline', 'mcv', 'mcv_sia']
+timesteps = dict(monthly=1/12, daily=1/365)
+
+
+def make_interventions(scenario):
+    """ Interventions for each standard scenario """
+    intv = []
+    if scenario in ['mcv', 'mcv_sia']:
+        my_vax1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
+        my_vax2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
+        intv += [
+            measles_routine_vx(name='routine1', start_year=2020, product=my_vax1, prob=.95, dose="mcv1"),
+            measles_routine_vx(name='routine2', start_year=2020, product=my_vax2, prob=.95, dose="mcv2"),
+        ]
+    if scenario == 'mcv_sia':
+        my_vax3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95))
+        intv += [measles_campaign_vx(name='SIA', years=np.arange(2021, 2030.5, 2), prob=0.95, product=my_vax3)]
+    return intv
+
+
+def make_sim(scenario, n_agents, dt, n_years=10, rand_seed=1):
+    """ Build one benchmark sim """
+    pars = dict(
+        n_agents = n_agents,
+        birth_rate = 27.58,
+        death_rate = 7.8,
+        networks = ss.RandomNet(pars={'n_contacts': 10})
+    )
+    sim = ss.Sim(
+        pars = pars,
+        start = 2020,
+        people = ss.People(n_agents=n_agents, age_data=pop_age),
+        diseases = SEIR(),
+        interventions = make_interventions(scenario),
+        rand_seed = rand_seed,
+        n_years = n_years,
+        dt = dt,
+        verbose = 0,
+    )
+    return sim
+
+
+def run_case(scenario, n_agents, dt, n_years):
+    """ Run one benchmark case and return its timings """
+    sim = make_sim(scenario, n_agents, dt, n_years=n_years)
+    start = sc.tic()
+    sim.initialize()
+    init_time = sc.toc(start, output=True)
+
+    SimProfiler(sim)
+    start = sc.tic()
+    sim.run()
+    run_time = sc.toc(start, output=True)
+    totals = sim.profiler.summary()
+
+    n_steps = sim.npts
+    out = dict(
+        scenario = scenario,
+        n_agents = n_agents,
+        dt = dt,
+        n_steps = n_steps,
+        init_time = init_time,
+        run_time = run_time,
+        agent_steps_per_sec = n_agents*n_steps/run_time,
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,  # ru_maxrss is in kB on Linux
+        module_time = dict(
+            disease = totals.update_pre + totals.transmission + totals.update_death,
+            network = totals.network,
+            intervention = totals.intervention,
+            results = totals.update_results,
+        ),
+    )
+    return out
+
+
+def git_commit():
+    """ Current commit hash, if available """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(sizes=(10_000, 100_000, 1_000_000), dts=('monthly', 'daily'), n_years=10, scenarios=scenarios):
+    """ Run all the cases, each in its own process, and return the results """
+    results = dict(commit=git_commit(), python=sys.version.split()[0], starsim=ss.__version__, n_years=n_years, cases=[])
+    for n_agents in sizes:
+        for dtkey in dts:
+            for scenario in scenarios:
+                print(f'Running {scenario} with {n_agents:,} agents and {dtkey} steps...')
+                with cf.ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+                    case = executor.submit(run_case, scenario, n_agents, timesteps[dtkey], n_years).result()
+                case['timestep'] = dtkey
+                print(f'  {case["agent_steps_per_sec"]:,.0f} agent-steps/s, {case["peak_rss_mb"]:,.0f} MB peak')
+                results['cases'].append(case)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the measles SEIR model')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='Population sizes')
+    parser.add_argument('--dts', nargs='+', default=['monthly', 'daily'], choices=list(timesteps.keys()), help='Timesteps')
+    parser.add_argument('--scenarios', nargs='+', default=scenarios, choices=scenarios, help='Scenarios')
+    parser.add_argument('--n-years', type=float, default=10, help='Number of years to simulate')
+    parser.add_argument('--out', default='benchmark.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    results = run_benchmarks(sizes=args.sizes, dts=args.dts, n_years=args.n_years, scenarios=args.scenarios)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved to {args.out}')
@@ -0,0 +1,119 @@
+"""
+Branch one sim into several intervention arms part-way through its run
+
+The sim is run once up to the branch point. Each arm then continues from a copy
+of that state, with some intervention parameters changed. For example, an mcv2
+coverage sweep only simulates the years before the sweep starts once:
+
+    arms = {f'mcv2={p:g}': {'routine2': dict(prob=p)} for p in scs.mcv2}
+    df = run_arms(sim, arms, year=2025)
+    df.groupby(['arm', 'year']).new_infections.sum()
+
+With ``shared=True`` (the default) the arms are loaded from a
+``PopulationSnapshot``. Their agent states are memory-mapped copy-on-write, so a
+state is only copied for an arm once that arm writes to it; states that never
+change (such as sex, uid and slot) stay shared. With ``shared=False`` each arm is
+a full deep copy. Either way the arms keep the same random number streams, so
+differences between them come from the interventions and not from chance.
+"""
+
+import numpy as np
+import pandas as pd
+import sciris as sc
+import starsim as ss
+
+from checkpoint import checkpoint_ti
+from replicates import PopulationSnapshot, results_keys
+
+delivery_keys = ['prob', 'years', 'start_year', 'end_year']  # Inputs from which RoutineDelivery/CampaignDelivery derive their timepoints
+
+
+def update_intervention(sim, intv, **kwargs):
+    """
+    Change the parameters of an initialized intervention.
+
+    Keys are attribute names, e.g. ``prob`` or ``eligibility``. Changing one of
+    the delivery inputs (prob, years, start_year, end_year) also recomputes the
+    timepoints and per-timestep probabilities, as at initialization.
+    """
+    for key, value in kwargs.items():
+        if not hasattr(intv, key):
+            errormsg = f'Intervention "{intv.name}" has no attribute "{key}"'
+            raise AttributeError(errormsg)
+
+    redeliver = any(key in delivery_keys for key in kwargs)
+    if redeliver and isinstance(intv, ss.RoutineDelivery):
+        if 'years' in kwargs:
+            intv.start_year = intv.end_year = None  # Set from the old years at initialization; the new years replace them
+        else:
+            intv.years = None  # Already expanded to every year; start_year and end_year give the same timepoints
+        if 'prob' not in kwargs:
+            errormsg = f'Please give a new prob for "{intv.name}", since the old one has already been converted to per-timestep values'
+            raise ValueError(errormsg)
+    for key, value in kwargs.items():
+        setattr(intv, key, sc.promotetoarray(value) if key == 'prob' else value)
+
+    if redeliver:
+        if isinstance(intv, ss.RoutineDelivery):
+            ss.RoutineDelivery.init_pre(intv, sim)
+        elif isinstance(intv, ss.CampaignDelivery):
+            intv.years = sc.promotetoarray(intv.years)
+            ss.CampaignDelivery.init_pre(intv, sim)
+    return intv
+
+
+def fork(sim, arms, ti=None, year=None, shared=True):
+    """
+    Run the sim up to the branch point, then copy it once per arm.
+
+    Args:
+        sim (Sim): the sim (initialized here if it isn't already)
+        arms (list/dict): one dict per arm mapping intervention names to dicts of
+            changes for update_intervention(); if a dict, its keys label the arms
+        ti (int): timestep to branch at (default: where the sim is now)
+        year (float): year to branch at, instead of ti
+        shared (bool): share unchanged agent states between the arms (see above)
+
+    Returns:
+        An objdict of sims, one per arm, each ready to continue with ``sim.run()``
+    """
+    if not isinstance(arms, dict):
+        arms = {f'arm{i}': arm for i, arm in enumerate(arms)}
+    if not sim.initialized:
+        sim.initialize()
+    if ti is not None or year is not None:
+        ti = checkpoint_ti(sim, ti=ti, year=year)
+        if sim.ti < ti:
+            sim.run(until=ti, verbose=0)
+
+    snapshot = PopulationSnapshot(sim) if shared else None
+    sims = sc.objdict()
+    try:
+        for label, arm in arms.items():
+            arm_sim = snapshot.load() if shared else sc.dcp(sim)
+            arm_sim.label = label
+            for name, changes in arm.items():
+                update_intervention(arm_sim, arm_sim.interventions[name], **changes)
+            sims[label] = arm_sim
+    finally:
+        if shared:
+            snapshot.cleanup()  # The arms keep their own mappings of the files
+    return sims
+
+
+def run_arms(sim, arms, ti=None, year=None, shared=True, disease='seir', keys=results_keys):
+    """
+    Fork the sim (see fork()), run each arm to the end, and collect the results.
+
+    Returns:
+        A long DataFrame with the year, the arm, and the given results of the disease
+    """
+    sims = fork(sim, arms, ti=ti, year=year, shared=shared)
+    dfs = []
+    for label, arm_sim in sims.items():
+        arm_sim.run(verbose=0)
+        df = pd.DataFrame({key: np.array(arm_sim.results[disease][key]) for key in keys})
+        df.insert(0, 'arm', label)
+        df.insert(0, 'year', arm_sim.yearvec)
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
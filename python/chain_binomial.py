@@ -0,0 +1,120 @@
+"""
+Stochastic chain-binomial version of the measles SEIR model
+
+Same model as ``CompartmentalSim``, but every flow between compartments is a
+binomial draw, so each stratum holds a whole number of people and runs show the
+same kind of stochastic fade-out and resurgence as the agent-based model. Memory
+and run time depend on the number of strata (age bins x vaccination strata x
+counties) rather than on the number of people, so whole-county and national
+populations can be run at full size instead of scaling up a sample of agents:
+
+    df = run_counties(pd.read_csv('pars_df.csv'), start=2020, n_years=10, dt=1/12)
+    df.groupby('year').new_infections.sum()  # National new infections
+"""
+
+import numpy as np
+import pandas as pd
+import sciris as sc
+import starsim as ss
+
+from compartmental import CompartmentalSim
+from county_calibration import county_population
+from vaccination import measles_vaccine, measles_routine_vx
+
+
+class ChainBinomialSim(CompartmentalSim):
+    """
+    Chain-binomial version of ``CompartmentalSim``; takes the same arguments.
+
+    Use ``n_agents`` (with no ``total_pop``) for the full population size.
+
+    Args:
+        rand_seed (int): random seed for the binomial draws
+    """
+
+    def __init__(self, *args, rand_seed=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rand_seed = rand_seed
+        return
+
+    def initialize(self):
+        """ Create the random number generator, then initialize as for CompartmentalSim """
+        self.rng = np.random.default_rng(self.rand_seed)
+        return super().initialize()
+
+    def as_counts(self, n):
+        """ Round expected numbers of people to whole numbers, randomly up or down """
+        return np.floor(n + self.rng.random(np.shape(n))).astype(np.int64)
+
+    def flow(self, n, p):
+        """ Number moving out of a compartment of size n with probability p: a binomial draw """
+        return self.rng.binomial(n, p)
+
+
+def county_interventions(county_row):
+    """ Routine MCV1 and MCV2 at the county's coverage (given in percent, and sometimes over 100) """
+    mcv1 = min(county_row['mcv1']/100, 1)
+    mcv2 = min(county_row['mcv2']/100, 1)
+    my_vax1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
+    my_vax2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
+    intv = [
+        measles_routine_vx(name='routine1', product=my_vax1, prob=mcv1, dose='mcv1'),
+        measles_routine_vx(name='routine2', product=my_vax2, prob=mcv2, dose='mcv2'),
+    ]
+    return intv
+
+
+def make_county_sim(county_row, interventions=county_interventions, rand_seed=1, **kwargs):
+    """
+    Chain-binomial sim of one county, at its full population size.
+
+    Args:
+        county_row (Series): the county's row of pars_df
+        interventions (func): takes the county row and returns the interventions
+        rand_seed (int): random seed
+        kwargs (dict): passed to ChainBinomialSim (e.g. start, n_years, dt)
+    """
+    from major_improvement import SEIR, pop_age
+
+    pars = dict(
+        n_agents = county_population(county_row['county']),
+        birth_rate = county_row['birth_rate'],
+        death_rate = county_row['death_rate'],
+        networks = ss.RandomNet(pars={'n_contacts': 10}),
+    )
+    disease = SEIR(
+        init_prev = ss.bernoulli(p=county_row['initial_prev']),
+        init_immune = ss.bernoulli(p=county_row['initial_immunity']),
+    )
+    intv = interventions(county_row) if interventions is not None else None
+    sim = ChainBinomialSim(pars=pars, age_data=pop_age, diseases=disease, interventions=intv, rand_seed=rand_seed, **kwargs)
+    return sim
+
+
+def run_counties(pars_df, rand_seed=1, **kwargs):
+    """
+    Run every county in pars_df and return their results as one long DataFrame.
+
+    Each county gets its own seed (rand_seed plus its row number).
+
+    Args:
+        pars_df (DataFrame): per-county parameters (one row per county)
+        rand_seed (int): base random seed
+        kwargs (dict): passed to make_county_sim()
+    """
+    dfs = []
+    for i, (_, county_row) in enumerate(pars_df.iterrows()):
+        sim = make_county_sim(county_row, rand_seed=rand_seed+i, **kwargs)
+        sim.run()
+        df = sim.to_df()
+        df.insert(1, 'county', county_row['county'])
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+if __name__ == '__main__':
+    pars_df = pd.read_csv('pars_df.csv')
+    T = sc.timer()
+    df = run_counties(pars_df, start=2020, n_years=10, dt=1/12)
+    T.toc(f'{len(pars_df)} counties')
+    print(df.groupby('year')[['n_alive', 'new_infections']].sum())
@@ -0,0 +1,92 @@
+"""
+Save a sim part-way through its run and continue it later
+
+Scenarios that share the same burn-in only need it to be simulated once: run
+the sim up to the point where the scenarios diverge, save it, and then start
+each scenario from the saved state.
+
+    sim = ss.Sim(pars=pars, people=ss.People(n_agents=25_000, age_data=pop_age), diseases=SEIR(), start=2010, end=2040)
+    save_checkpoint(sim, 'burnin.sim', year=2020)  # Runs 2010-2020, then saves
+    sim = load_checkpoint('burnin.sim')
+    sim.run()  # Continues from 2020
+
+The checkpoint is a gzipped pickle of the whole sim. It includes every agent
+state (including the dose history in ``sim.people.doses``), the network, the
+results so far, the interventions and the random number streams. Starsim resets
+each stream from its initial state and the timestep, so a sim that is saved and
+then continued gives exactly the same results as one run straight through.
+"""
+
+import copyreg
+import numpy as np
+import starsim as ss
+
+
+def _reduce_result(res):
+    """ Pickle an ss.Result with its name, scale etc., which plain ndarray pickling drops """
+    attrs = {attr: getattr(res, attr, None) for attr in res._custom_attrs}
+    return _rebuild_result, (np.asarray(res), attrs)
+
+
+def _rebuild_result(arr, attrs):
+    res = arr.view(ss.Result)
+    for attr, value in attrs.items():
+        setattr(res, attr, value)
+    return res
+
+
+copyreg.pickle(ss.Result, _reduce_result)
+
+
+def checkpoint_ti(sim, ti=None, year=None):
+    """ Timestep to stop at, given either a timestep or a year (the first timestep at or after it) """
+    if (ti is None) == (year is None):
+        errormsg = 'Please supply either ti or year'
+        raise ValueError(errormsg)
+    if year is not None:
+        ti = int(np.searchsorted(sim.yearvec, year - 1e-9))  # Tolerance for the floating-point yearvec
+    if not 0 <= ti < sim.npts:
+        errormsg = f'Checkpoint ti={ti} is outside the sim ({sim.npts} timesteps)'
+        raise ValueError(errormsg)
+    return ti
+
+
+def save_checkpoint(sim, filename, ti=None, year=None, verbose=0):
+    """
+    Run the sim up to (but not including) timestep ti or the given year, and save it.
+
+    If neither is given, the sim is saved where it is. The sim itself is left at
+    the checkpoint, so it can be continued with ``sim.run()``.
+
+    Args:
+        sim (Sim): the sim (initialized here if it isn't already)
+        filename (str): file to save to
+        ti (int): timestep to stop at
+        year (float): year to stop at, instead of ti
+        verbose (int): passed to sim.run()
+
+    Returns:
+        The path of the saved file
+    """
+    if not sim.initialized:
+        sim.initialize()
+    if ti is not None or year is not None:
+        ti = checkpoint_ti(sim, ti=ti, year=year)
+        if sim.ti > ti:
+            errormsg = f'Sim is already at ti={sim.ti}, past the checkpoint at ti={ti}'
+            raise ValueError(errormsg)
+        if sim.ti < ti:
+            sim.run(until=ti, verbose=verbose)
+    if sim.complete:
+        errormsg = 'Sim has already finished, so there is nothing left to continue'
+        raise ValueError(errormsg)
+    return sim.save(filename, keep_people=True)
+
+
+def load_checkpoint(filename):
+    """ Load a sim saved with save_checkpoint(), ready to continue with ``sim.run()`` """
+    sim = ss.Sim.load(filename)
+    if sim.complete:
+        errormsg = f'{filename} is a finished sim, not a checkpoint'
+        raise ValueError(errormsg)
+    return sim
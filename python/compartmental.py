@@ -0,0 +1,452 @@
+"""
+Deterministic compartmental version of the measles SEIR model
+
+For screening many scenarios without running agents. ``CompartmentalSim`` takes
+the same inputs as the agent-based sim in ``major_improvement.py`` (the sim
+pars, the age data, an ``SEIR`` disease and the vaccination interventions) and
+produces the same results, as expected counts rather than draws:
+
+    sim = CompartmentalSim(pars=pars, age_data=pop_age, diseases=SEIR(), interventions=intv,
+                           start=2020, n_years=10, dt=1/12)
+    sim.run()
+    sim.results.seir.new_infections
+
+Susceptibles are tracked by monthly age bin and vaccination stratum (doses
+received and relative susceptibility), since vaccination and the immunity age
+depend on age. Exposed and infectious people are tracked by time since
+infection instead, so that the durations follow the disease's own ``dur_exp``
+and ``dur_inf`` distributions, discretized to timesteps as in the agent model.
+Transmission is the mean-field equivalent of the random network: each person has
+``n_contacts`` contacts per timestep, each infectious with probability I/N.
+
+Results are always reported on the sim's time vector (``dt``), but each
+timestep can be split into ``n_substeps`` shorter steps, e.g. roughly daily
+steps within monthly reporting. With ``adaptive=True`` the short steps are only
+used while an outbreak is under way (prevalence of at least ``fine_prevalence``)
+and a single step is taken otherwise. The delay distributions are discretized on
+the short step, so a long step moves each infection cohort on by the exact
+amount the short steps would have. ``adaptive.AdaptiveSim`` does the same for the
+agent-based model.
+"""
+
+import numpy as np
+import pandas as pd
+import sciris as sc
+import starsim as ss
+
+from vaccination import measlesBaseVaccination, measles_routine_vx, measles_vaccine
+
+
+def dist_quantiles(dist, n=500):
+    """ Evenly spaced quantiles of a Starsim distribution, used as a deterministic sample """
+    dist = sc.dcp(dist)
+    dist.process_dist()
+    dist.process_pars(call=False)
+    return dist.ppf((np.arange(n) + 0.5)/n)
+
+
+def dist_p(dist):
+    """ Probability of a Bernoulli distribution (or a plain number) """
+    return dist.pars.p if isinstance(dist, ss.Dist) else dist
+
+
+class CompartmentalSim:
+    """
+    Age-structured difference-equation version of the SEIR model.
+
+    Args:
+        pars (dict): sim parameters, as for ``ss.Sim`` (n_agents, total_pop, birth_rate, death_rate, networks)
+        age_data (DataFrame): initial age distribution, as for ``ss.People``
+        diseases (SEIR): the disease, whose parameters are used
+        interventions (list): ``measles_routine_vx``, ``measles_campaign_vx`` and ``ss.campaign_vx`` interventions with ``measles_vaccine`` products
+        age_bin (float): width of the age bins, in years
+        max_age (float): age of the last (open) age bin
+        n_substeps (int): number of steps per reporting timestep (dt)
+        adaptive (bool): if True, only use the substeps while prevalence is at least fine_prevalence
+        fine_prevalence (float): prevalence (exposed and infectious) above which substeps are used, if adaptive
+        kwargs (dict): also merged into pars (e.g. start, n_years, dt)
+    """
+
+    def __init__(self, pars=None, age_data=None, diseases=None, interventions=None, age_bin=1/12,
+                 max_age=120, n_substeps=1, adaptive=False, fine_prevalence=1e-4, **kwargs):
+        self.pars = sc.objdict(n_agents=10_000, total_pop=None, birth_rate=0, death_rate=0, networks=None,
+                               start=2000, end=None, n_years=50, dt=1.0)
+        self.pars.update(sc.mergedicts(pars, kwargs))
+        self.age_data = age_data
+        self.disease = diseases
+        self.interventions = sc.tolist(interventions)
+        self.age_bin = age_bin
+        self.max_age = max_age
+        self.n_substeps = n_substeps
+        self.adaptive = adaptive
+        self.fine_prevalence = fine_prevalence
+        self.initialized = False
+        return
+
+    def initialize(self):
+        """ Set up the time vector, the delay distributions and the initial state """
+        self.init_time()
+        self.init_transmission()
+        self.init_delays()
+        self.init_interventions()
+        self.init_state()
+        self.init_results()
+        self.initialized = True
+        return self
+
+    def init_time(self):
+        """ Time vector, computed as in ``ss.Sim`` """
+        p = self.pars
+        if p.end is None:
+            p.end = p.start + p.n_years
+        self.dt = p.dt
+        self.yearvec = np.arange(start=p.start, stop=p.end + p.dt, step=p.dt)
+        self.npts = len(self.yearvec)
+        self.tivec = np.arange(self.npts)
+        self.ti = 0
+        self.dt_fine = self.dt/self.n_substeps  # Length of a substep
+        self.elapsed = 0  # Number of substeps run so far
+        return
+
+    def init_transmission(self):
+        """
+        Transmission probability per contact for every substep, from the disease's
+        beta schedule (held constant within each timestep) or its seasonal
+        forcing, and the number of contacts per person per timestep, summed over
+        the networks
+        """
+        dp = self.disease.pars
+        if dp.beta_schedule is None:
+            t = np.arange(self.npts*self.n_substeps)*self.dt_fine
+            beta_rate = dp.beta_mean*(1 + dp.beta_amplitude*np.cos(2*np.pi*t))
+        else:
+            beta_rate = dp.beta_schedule(self) if callable(dp.beta_schedule) else dp.beta_schedule
+            beta_rate = np.repeat(np.asarray(beta_rate, dtype=float), self.n_substeps)
+        self.beta_prob = 1 - np.exp(-beta_rate)
+
+        self.n_contacts = 0
+        for net in sc.tolist(self.pars.networks):
+            n_contacts = net.pars.n_contacts
+            if isinstance(n_contacts, ss.Dist):
+                n_contacts = dist_quantiles(n_contacts).mean()
+            self.n_contacts += n_contacts  # n_contacts/2 edges as the source and n_contacts/2 as the target
+        return
+
+    def init_delays(self):
+        """
+        Probability of having become infectious, and of having recovered (or
+        died), by time since infection in substeps. As in ``SEIR.set_prognoses``,
+        the durations are drawn independently, the transition to infectious
+        happens after ceil(dur_exp/dt) steps and the end of infection after
+        ceil((dur_exp + dur_inf)/dt) steps, with dt the substep length.
+
+        Cohorts are only tracked up to the longest infection plus one long step,
+        by when every infection has ended and been processed, so the cost of a
+        step stops growing with time once the sim is longer than that.
+        """
+        dp = self.disease.pars
+        dt = self.dt_fine
+        K = self.npts*self.n_substeps + 1  # Nobody can be infected for longer than the sim
+        dur_exp = dist_quantiles(dp.dur_exp)
+        dur_inf = dist_quantiles(dp.dur_inf)
+        k_inf = np.minimum(np.ceil(dur_exp/dt), K).astype(int)
+        k_end = np.minimum(np.ceil((dur_exp[:, None] + dur_inf[None, :])/dt), K).astype(int).ravel()
+        K = min(K, k_end.max() + self.n_substeps)  # A cohort can be moved on by up to n_substeps before it is next updated
+        self.cdf_inf = np.cumsum(np.bincount(k_inf, minlength=K+1))[:K]/len(k_inf)  # P(infectious by k)
+        self.cdf_end = np.cumsum(np.bincount(k_end, minlength=K+1))[:K]/len(k_end)  # P(recovered/dead by k)
+        self.p_death = dist_p(dp.p_death)
+        self._hazards = {}
+        return
+
+    def hazards(self, m):
+        """
+        Probabilities of becoming infectious, and of infection ending, over a
+        step of m substeps, for those still exposed (or infectious) at each time
+        since infection (at the end of the step)
+        """
+        if m not in self._hazards:
+            cdf_inf, cdf_end = self.cdf_inf, self.cdf_end
+            prev_inf = np.concatenate([np.zeros(m), cdf_inf[:-m]])
+            prev_end = np.concatenate([np.zeros(m), cdf_end[:-m]])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                h_inf = np.nan_to_num(np.clip((cdf_inf - prev_inf)/(1 - prev_inf), 0, 1), nan=1.0)
+                h_end = np.nan_to_num(np.clip((cdf_end - prev_end)/(cdf_inf - prev_end), 0, 1), nan=0.0)
+            self._hazards[m] = (h_inf, h_end)
+        return self._hazards[m]
+
+    def init_interventions(self):
+        """ Timepoints and per-timestep probabilities, interpolated as for the agent-based sim """
+        timeline = sc.objdict(pars=sc.objdict(start=self.pars.start, end=self.pars.end), yearvec=self.yearvec, dt=self.dt)
+        bin_ages = np.arange(self.n_bins)*self.age_bin  # Exact ages of those born during the sim
+        self.deliveries = []
+        for intv in self.interventions:
+            intv = sc.dcp(intv)
+            if not isinstance(intv.product, measles_vaccine):
+                errormsg = f'Only measles_vaccine products are supported, not {type(intv.product)}'
+                raise TypeError(errormsg)
+            if intv.product.pars.waning is not None:
+                errormsg = f'Waning protection ({intv.product.name}) is only supported by the agent-based model'
+                raise ValueError(errormsg)
+            delivery = sc.objdict(efficacy=intv.product.pars.efficacy, leaky=intv.product.pars.leaky, dose=None,
+                                  counted=False, bins=slice(None))
+            if isinstance(intv, measles_routine_vx):
+                ss.RoutineDelivery.init_pre(intv, timeline)
+            elif isinstance(intv, ss.CampaignDelivery):
+                ss.CampaignDelivery.init_pre(intv, timeline)
+            else:
+                errormsg = f'Cannot convert intervention {type(intv)} to a compartmental form'
+                raise TypeError(errormsg)
+            if isinstance(intv, measlesBaseVaccination):  # Recorded in the dose registry
+                delivery.dose = intv.check_dose(timeline)
+                delivery.counted = True
+                window = intv.check_window(timeline)
+                if window is not None:
+                    age_min, age_max = window
+                    delivery.bins = (bin_ages >= age_min - 1e-9) & (bin_ages <= age_max + 1e-9)
+            delivery.prob = dict(zip(np.atleast_1d(intv.timepoints), intv.prob))
+            self.deliveries.append(delivery)
+        return
+
+    @property
+    def n_bins(self):
+        return int(round(self.max_age/self.age_bin))
+
+    def init_state(self):
+        """ Initial susceptibles by age, then the initial infections and immunity """
+        p = self.pars
+        dp = self.disease.pars
+        self.pop_scale = 1 if p.total_pop is None else p.total_pop/p.n_agents
+        n_total = p.n_agents*self.pop_scale
+
+        # Spread each age group in the data uniformly over its age bins, as ss.histogram does
+        ages = self.age_data['age'].values.astype(float)
+        values = self.age_data['value'].values.astype(float)
+        edges = np.append(ages, ages[-1] + (ages[-1] - ages[-2]))
+        bin_edges = np.arange(self.n_bins + 1)*self.age_bin
+        cum = np.interp(bin_edges, edges, np.concatenate([[0], np.cumsum(values)]))
+        by_age = np.diff(cum)/values.sum()*n_total
+
+        # Vaccination strata, keyed by (number of doses, relative susceptibility)
+        self.strata = [(0, 1.0)]
+        self.S = self.as_counts(by_age)[None, :]
+
+        # Initial infections, then initial immunity among the remaining susceptibles
+        n_seed = self.flow(self.S, dist_p(dp.init_prev))
+        self.S -= n_seed
+        n_immune = self.flow(self.S, dist_p(dp.init_immune))
+        self.S -= n_immune
+        self.R = n_immune.sum()
+
+        # Exposed and infectious, by timesteps since infection
+        self.E = np.zeros(len(self.cdf_inf), dtype=self.S.dtype)
+        self.I = np.zeros(len(self.cdf_inf), dtype=self.S.dtype)
+        self.E[0] = n_seed.sum()
+        self.dying = 0
+        self.age_clock = 0
+        if dp.immune_age is None:
+            self.immune_bins = slice(0, 0)
+        else:
+            self.immune_bins = slice(int(np.floor(dp.immune_age/self.age_bin)) + 1, None)  # Bins entirely above immune_age
+        return
+
+    def init_results(self):
+        """ Same result keys as SEIR, plus the number alive """
+        npts = self.npts
+        res = sc.objdict()
+        for key in ['n_susceptible', 'n_exposed', 'n_infected', 'n_recovered', 'new_infections', 'cum_infections',
+                    'prevalence', 'incidence']:
+            res[key] = np.zeros(npts)
+        self.results = sc.objdict(yearvec=self.yearvec, n_alive=np.zeros(npts), n_substeps=np.zeros(npts, dtype=int))
+        self.results[self.disease.name] = res
+        return
+
+    def as_counts(self, n):
+        """ Convert expected numbers of people into the numbers tracked; unchanged here """
+        return n
+
+    def flow(self, n, p):
+        """ Number moving out of a compartment of size n with probability p; the expected value here """
+        return n*p
+
+    @property
+    def n_alive(self):
+        return self.S.sum() + self.E.sum() + self.I.sum() + self.R + self.dying
+
+    def stratum(self, key):
+        """ Index of the vaccination stratum with this key, adding it if needed """
+        key = (key[0], round(key[1], 12))
+        if key not in self.strata:
+            self.strata.append(key)
+            self.S = np.vstack([self.S, np.zeros_like(self.S[0])])
+        return self.strata.index(key)
+
+    def births(self, dt):
+        """ Births over a step of length dt, as for ss.Births """
+        p = self.pars
+        self.S[0, 0] += self.flow(self.n_alive, p.birth_rate*1e-3*dt)
+        return
+
+    def progress(self, m):
+        """ Infection progression over a step of m substeps, as for SEIR.update_pre """
+        # Susceptibles past the disease's immune_age are moved to recovered
+        old = self.immune_bins
+        self.R += self.S[:, old].sum()
+        self.S[:, old] = 0
+
+        # Exposed -> infectious -> recovered or dead, by time since infection
+        h_inf, h_end = self.hazards(m)
+        k = slice(m, self.elapsed + 1)
+        new_infectious = self.flow(self.E[k], h_inf[k])
+        self.E[k] -= new_infectious
+        self.I[k] += new_infectious
+        ended = self.flow(self.I[k], h_end[k])
+        self.I[k] -= ended
+        self.dying = self.flow(ended.sum(), self.p_death)  # Still infectious until the end of the timestep
+        self.R += ended.sum() - self.dying
+        return
+
+    def vaccinate(self, m):
+        """
+        Routine and campaign vaccination over a step of m substeps, as for
+        measles_routine_vx, measles_campaign_vx and ss.campaign_vx. The
+        probability per timestep is spread evenly over its substeps.
+        """
+        for delivery in self.deliveries:
+            prob = delivery.prob.get(self.ti)
+            if prob is None:
+                continue
+            if m < self.n_substeps:
+                prob = 1 - (1 - prob)**(m/self.n_substeps)
+            dose, bins, efficacy = delivery.dose, delivery.bins, delivery.efficacy
+            for s, (n_doses, rel_sus) in enumerate(list(self.strata)):
+                if dose is not None and n_doses != dose - 1:  # As for DoseRegistry.eligible()
+                    continue
+                new_key = (n_doses + delivery.counted,)
+
+                vaccinated = self.flow(self.S[s, bins], prob)
+                self.S[s, bins] -= vaccinated
+                if delivery.leaky:
+                    moved = [(rel_sus*(1 - efficacy), vaccinated)]
+                else:
+                    took = self.flow(vaccinated, efficacy)
+                    moved = [(0.0, took), (rel_sus, vaccinated - took)]  # Both go to the same stratum if rel_sus is already 0
+                for new_rel_sus, n in moved:
+                    t = self.stratum(new_key + (new_rel_sus,))  # May add a row to S, so look it up first
+                    self.S[t, bins] += n
+        return
+
+    def transmit(self, dt):
+        """ New infections over a step of length dt: each of a person's contacts is infectious with probability I/N """
+        n_alive = self.n_alive
+        frac_inf = (self.I.sum() + self.dying)/n_alive if n_alive else 0
+        rel_sus = np.array([key[1] for key in self.strata])
+        p_inf = 1 - (1 - rel_sus*self.beta_prob[self.elapsed]*dt*frac_inf)**self.n_contacts
+        new = self.flow(self.S, p_inf[:, None])
+        self.S -= new
+        return new.sum()
+
+    def deaths(self, dt):
+        """ Disease deaths, then background deaths over a step of length dt, as for ss.Deaths """
+        self.dying = 0
+        p_survive = 1 - self.pars.death_rate*1e-3*dt
+        self.S -= self.flow(self.S, 1 - p_survive)
+        self.E -= self.flow(self.E, 1 - p_survive)
+        self.I -= self.flow(self.I, 1 - p_survive)
+        self.R -= self.flow(self.R, 1 - p_survive)
+        return
+
+    def update_results(self, new_infections):
+        """ Store the results for this timestep """
+        ti = self.ti
+        res = self.results[self.disease.name]
+        n_alive = self.n_alive
+        self.results.n_alive[ti] = n_alive
+        res.n_susceptible[ti] = self.S.sum()
+        res.n_exposed[ti] = self.E.sum()
+        res.n_infected[ti] = self.I.sum()
+        res.n_recovered[ti] = self.R
+        res.new_infections[ti] = new_infections
+        res.cum_infections[ti] = res.cum_infections[ti-1] + new_infections if ti else new_infections
+        res.prevalence[ti] = (res.n_infected[ti] + res.n_exposed[ti])/n_alive
+        res.incidence[ti] = new_infections/n_alive*1000
+        return
+
+    def age(self, m):
+        """ Move everyone on by m substeps: susceptibles by age bin once a bin's width has passed """
+        self.E[m:] = self.E[:-m].copy()
+        self.I[m:] = self.I[:-m].copy()
+        self.E[:m] = self.I[:m] = 0
+        self.elapsed += m
+        self.age_clock += m*self.dt_fine
+        while self.age_clock >= self.age_bin - 1e-9:
+            self.S[:, -1] += self.S[:, -2]
+            self.S[:, 1:-1] = self.S[:, :-2].copy()
+            self.S[:, 0] = 0
+            self.age_clock -= self.age_bin
+        return
+
+    def substep(self, m):
+        """ A step of m substeps, in the same order as ss.Sim.step; returns the new infections """
+        dt = m*self.dt_fine
+        seeds = self.E[0] if self.elapsed == 0 else 0
+        self.births(dt)
+        self.progress(m)
+        self.vaccinate(m)
+        new_infections = self.transmit(dt) + seeds
+        self.E[0] = new_infections
+        self.deaths(dt)
+        return new_infections
+
+    def outbreak(self):
+        """ Whether prevalence is high enough for short steps """
+        return (self.E.sum() + self.I.sum()) >= self.fine_prevalence*self.n_alive
+
+    def step(self):
+        """ One reporting timestep, made up of substeps (or one long step, if adaptive and there is no outbreak) """
+        if self.adaptive and not self.outbreak():
+            n, m = 1, self.n_substeps
+        else:
+            n, m = self.n_substeps, 1
+        new_infections = 0
+        for i in range(n):
+            if i:
+                self.age(m)
+            new_infections += self.substep(m)
+        self.results.n_substeps[self.ti] = n
+        self.update_results(new_infections)
+        self.age(m)
+        self.ti += 1
+        return
+
+    def run(self):
+        """ Run the model """
+        if not self.initialized:
+            self.initialize()
+        while self.ti < self.npts:
+            self.step()
+        return self
+
+    def to_df(self):
+        """ Results as a DataFrame, one row per timestep """
+        df = pd.DataFrame(self.results[self.disease.name])
+        df.insert(0, 'year', self.yearvec)
+        df['n_alive'] = self.results.n_alive
+        return df
+
+
+if __name__ == '__main__':
+    from major_improvement import SEIR, pop_age
+    from benchmark import make_interventions
+
+    pars = dict(
+        n_agents = 25_000,
+        birth_rate = 27.58,
+        death_rate = 7.8,
+        networks = ss.RandomNet(pars={'n_contacts': 10}),
+    )
+    sim = CompartmentalSim(pars=pars, age_data=pop_age, diseases=SEIR(), interventions=make_interventions('mcv'),
+                           start=2020, n_years=10, dt=1/12)
+    T = sc.timer()
+    sim.run()
+    T.toc('Compartmental model')
+    print(sim.to_df())
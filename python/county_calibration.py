@@ -0,0 +1,180 @@
+"""
+Calibrate every county in parallel
+
+Each county gets its own Optuna study (``measles_<county>``), stored in one shared
+local SQLite file such as ``starsim_calibration.db``. The studies are independent,
+so they run concurrently in a process pool; SQLite serializes the writes, and
+each worker only ever touches its own study, so workers do not collide. Rerunning
+the driver resumes each study up to the requested number of trials.
+
+Each trial runs the SEIR model with the county's birth and death rates and
+population (``data/cy.csv``), and compares monthly new infections with the
+county's "IDSR Measles Total" series from ``data/county_measles.csv``. The first
+trial of each study starts from the county's ``initial_prev`` and
+``initial_immunity`` in ``pars_df.csv`` (clipped to the search bounds). Every
+trial seeds at least one infection, however low its init_prev.
+
+    python county_calibration.py
+"""
+
+import os
+import hashlib
+import multiprocessing as mp
+import concurrent.futures as cf
+import numpy as np
+import pandas as pd
+import sciris as sc
+import starsim as ss
+
+from surrogate_calibration import make_calibration_sim, series_loss
+
+default_storage = 'sqlite:///starsim_calibration.db'
+
+county_bounds = sc.objdict(
+    beta = [0.5, 1.0],              # Mean transmission rate of the seasonal forcing
+    init_prev = [1e-6, 1e-2],       # Initial prevalence (sampled on a log scale)
+    init_immune = [0.3, 0.95],      # Share of the initial susceptibles who are immune
+    beta_amplitude = [0.0, 0.5],    # Amplitude of seasonal forcing
+)
+
+
+class seed_bernoulli(ss.bernoulli):
+    """
+    Bernoulli draw that always picks at least min_seeds agents.
+
+    County prevalences are often below one agent in a 10,000-agent sim, which
+    would seed no infections at all and give every such trial the same loss. If
+    too few agents are picked, the ones with the lowest random numbers are added.
+    """
+    def __init__(self, p=0.5, min_seeds=1, **kwargs):
+        super().__init__(p=p, **kwargs)
+        self.min_seeds = min_seeds
+        return
+
+    def make_rvs(self):
+        rands = self.rng.random(self._size)
+        rvs = rands < self._pars.p
+        slots = np.arange(self._size) if self._slots is None else np.asarray(self._slots)
+        n_missing = self.min_seeds - rvs[slots].sum()
+        if n_missing > 0:
+            unpicked = slots[~rvs[slots]]
+            rvs[unpicked[np.argsort(rands[unpicked], kind='stable')[:n_missing]]] = True
+        return rvs
+
+
+def county_series(county, data_path='data/county_measles.csv'):
+    """ Monthly reported cases for one county, in date order """
+    data = pd.read_csv(data_path)
+    data = data[data.organisationunitname == f'{county} County'].sort_values('periodid')
+    return data['IDSR Measles Total'].values
+
+
+def county_key(name):
+    """ County name reduced to lowercase letters, since the data files spell some names differently (e.g. Murang'a, Nairobi City) """
+    key = ''.join(c for c in name.lower() if c.isalpha())
+    return key.removesuffix('city')
+
+
+def county_population(county, data_path='data/cy.csv', year=2020):
+    """ County population in the given year """
+    data = pd.read_csv(data_path)
+    match = (data.county.map(county_key) == county_key(county)) & (data.year == year)
+    return data[match].n_alive.iloc[0]
+
+
+def study_seed(rand_seed, county, n_trials):
+    """ Sampler seed for a county's study, different for each county and for each resume of the study """
+    payload = f'{rand_seed}:{county_key(county)}:{n_trials}'
+    return int(hashlib.sha1(payload.encode()).hexdigest(), 16) % 2**32
+
+
+def get_storage(storage):
+    """ Optuna storage with a generous lock timeout, since several workers share the file """
+    import optuna
+    if storage.startswith('sqlite'):
+        storage = optuna.storages.RDBStorage(storage, engine_kwargs=dict(connect_args=dict(timeout=60)))
+    return storage
+
+
+def calibrate_county(county_row, n_trials=50, storage=default_storage, n_agents=10_000, n_years=4, rand_seed=1):
+    """
+    Run (or resume) the study for one county until it has n_trials completed trials.
+
+    Returns:
+        A dict with the county, the best loss and the best parameters
+    """
+    import optuna
+
+    county = county_row['county']
+    cases = county_series(county)
+    total_pop = county_population(county)
+
+    study = optuna.create_study(study_name=f'measles_{county}', storage=get_storage(storage),
+                                direction='minimize', load_if_exists=True)
+    study.sampler = optuna.samplers.TPESampler(seed=study_seed(rand_seed, county, len(study.trials)))
+    if not len(study.trials):
+        start = dict(init_prev=county_row['initial_prev'], init_immune=county_row['initial_immunity'])
+        start = {key: float(np.clip(value, *county_bounds[key])) for key, value in start.items()} # Enqueued values outside the bounds would fail the trial
+        study.enqueue_trial(start, skip_if_exists=True)
+
+    def objective(trial):
+        b = county_bounds
+        pars = sc.objdict(
+            beta = trial.suggest_float('beta', *b.beta),
+            init_prev = trial.suggest_float('init_prev', *b.init_prev, log=True),
+            init_immune = trial.suggest_float('init_immune', *b.init_immune),
+            beta_amplitude = trial.suggest_float('beta_amplitude', *b.beta_amplitude),
+        )
+        sim = make_calibration_sim(pars, n_agents=n_agents, total_pop=total_pop, birth_rate=county_row['birth_rate'],
+                                   death_rate=county_row['death_rate'], n_years=n_years, rand_seed=rand_seed,
+                                   init_prev=seed_bernoulli(p=pars.init_prev, min_seeds=1))
+        sim.run()
+        return series_loss(sim.results.seir.new_infections, cases)
+
+    n_complete = len(study.get_trials(states=[optuna.trial.TrialState.COMPLETE]))
+    if n_complete < n_trials:
+        study.optimize(objective, n_trials=n_trials-n_complete)
+
+    out = dict(county=county, loss=study.best_value, **study.best_params)
+    return out
+
+
+def calibrate_counties(pars_df, n_trials=50, n_workers=None, storage=default_storage, **kwargs):
+    """
+    Calibrate all the counties in pars_df concurrently, one study per county.
+
+    Args:
+        pars_df (DataFrame): per-county parameters (one row per county)
+        n_trials (int): number of completed trials wanted per county
+        n_workers (int): number of worker processes (default: number of CPUs)
+        storage (str): Optuna storage URL shared by all the studies
+        kwargs (dict): passed to calibrate_county()
+
+    Returns:
+        A DataFrame with the best loss and parameters for each county
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    # Create the storage schema once up front, so the workers don't race to create it
+    import optuna
+    optuna.create_study(study_name='measles_setup', storage=get_storage(storage), load_if_exists=True)
+    optuna.delete_study(study_name='measles_setup', storage=get_storage(storage))
+
+    rows = [row for _, row in pars_df.iterrows()]
+    results = []
+    with cf.ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn')) as executor:
+        futures = {executor.submit(calibrate_county, row, n_trials=n_trials, storage=storage, **kwargs): row['county'] for row in rows}
+        for future in cf.as_completed(futures):
+            result = future.result()
+            print(f'Calibrated {result["county"]}: loss {result["loss"]:0.4g}')
+            results.append(result)
+
+    df = pd.DataFrame(results).set_index('county').loc[[row['county'] for row in rows]].reset_index()
+    return df
+
+
+if __name__ == '__main__':
+    pars_df = pd.read_csv('pars_df.csv')
+    best = calibrate_counties(pars_df)
+    best.to_csv('county_calibration.csv', index=False)
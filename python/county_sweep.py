@@ -0,0 +1,266 @@
+"""
+Parallel county x scenario sweeps
+
+Runs the same (county, mcv1/mcv2 scenario) grid as ``measles_fnc_practice.county_sim``
+but fans the independent sims out over a process pool. Every job gets a
+deterministic seed (``rand_seed`` + job index) so a sweep is reproducible
+regardless of the number of workers or the order in which jobs finish.
+
+Finished jobs can be recorded in a ``SweepJournal`` (a local SQLite file) so a
+sweep that crashes or is killed can be restarted and only the missing jobs rerun,
+and each job's results can be streamed to disk as soon as it finishes through a
+``CSVSink`` or ``ParquetSink``.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import multiprocessing as mp
+import concurrent.futures as cf
+import numpy as np
+import pandas as pd
+import sciris as sc
+
+from measles_fnc_practice import county_scenario_sim
+
+
+def make_jobs(pars_df, scs, rand_seed=1):
+    """
+    Build the list of sweep jobs, one per (county, scenario) pair, in the same
+    order as the nested loops in ``county_sim``.
+    """
+    jobs = []
+    for _, county_row in pars_df.iterrows():
+        for _, sc_row in scs.iterrows():
+            job = sc.objdict(
+                job_index=len(jobs),
+                county_row=county_row,
+                sc_row=sc_row,
+                seed=rand_seed + len(jobs),
+            )
+            job.key = job_key(county_row, sc_row, job.seed)
+            jobs.append(job)
+    return jobs
+
+
+def job_key(county_row, sc_row, seed):
+    """ Hash of the county row, scenario row and seed that identifies a job """
+    payload = dict(county=county_row.to_dict(), scenario=sc_row.to_dict(), seed=seed)
+    payload = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class SweepJournal:
+    """
+    On-disk record of finished sweep jobs, stored in a SQLite file.
+
+    Each job's results are written to the ``results`` table tagged with the job
+    key, and the key is then added to the ``jobs`` table. A job only counts as
+    done once its key is in ``jobs``, so rows left behind by a job that was
+    interrupted mid-write are discarded when the journal is reopened.
+
+    Args:
+        path (str): path to the SQLite file (created if it does not exist)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        with self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS jobs (job_key TEXT PRIMARY KEY)')
+            tables = [row[0] for row in self.con.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            if 'results' in tables:
+                self.con.execute('DELETE FROM results WHERE job_key NOT IN (SELECT job_key FROM jobs)')
+        return
+
+    def done(self):
+        """ Return the set of keys of jobs that have finished """
+        return {row[0] for row in self.con.execute('SELECT job_key FROM jobs')}
+
+    def record(self, key, df):
+        """ Store the results of a finished job """
+        df.assign(job_key=key).to_sql('results', self.con, if_exists='append', index=False)
+        with self.con:
+            self.con.execute('INSERT OR REPLACE INTO jobs (job_key) VALUES (?)', (key,))
+        return
+
+    def load(self, key):
+        """ Load the results of a finished job """
+        df = pd.read_sql('SELECT * FROM results WHERE job_key = ?', self.con, params=(key,))
+        return df.drop(columns='job_key')
+
+    def close(self):
+        self.con.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return
+
+
+class CSVSink:
+    """
+    Append each run's results to a CSV file as soon as the run finishes.
+
+    The file is complete after every write, so partial results can be read
+    while the sweep is still running.
+
+    Args:
+        path (str): path to the CSV file
+        overwrite (bool): whether to start a new file rather than append to an existing one
+    """
+
+    def __init__(self, path, overwrite=False):
+        self.path = path
+        if overwrite and os.path.exists(path):
+            os.remove(path)
+        return
+
+    def write(self, df):
+        header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        df.to_csv(self.path, mode='a', header=header, index=False)
+        return
+
+    def close(self):
+        return
+
+
+class ParquetSink:
+    """
+    Write each run's results to a Parquet file as its own row group.
+
+    Requires pyarrow. The file footer is only written by ``close()``, so use a
+    CSVSink if results need to be read mid-sweep.
+
+    Args:
+        path (str): path to the Parquet file (overwritten)
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as E:
+            errormsg = 'ParquetSink requires pyarrow (pip install pyarrow), or use CSVSink instead'
+            raise ImportError(errormsg) from E
+        self.path = path
+        self.pa = pa
+        self.pq = pq
+        self.writer = None
+        return
+
+    def write(self, df):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        return
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        return
+
+
+def run_job(job, sim_fn=None):
+    """ Run a single sweep job; this is what the worker processes execute """
+    if sim_fn is None:
+        sim_fn = county_scenario_sim
+    return sim_fn(job.county_row, job.sc_row, rand_seed=job.seed)
+
+
+def county_sim_parallel(pars_df, scs, n_workers=None, rand_seed=1, journal=None, sink=None, collect=True,
+                        sim_fn=None, mp_context=None):
+    """
+    Parallel version of ``county_sim``.
+
+    Args:
+        pars_df (DataFrame): per-county parameters (one row per county)
+        scs (DataFrame): scenarios, with ``mcv1`` and ``mcv2`` coverage columns
+        n_workers (int): number of worker processes (default: number of CPUs)
+        rand_seed (int): base seed; job i is run with ``rand_seed + i``
+        journal (str/SweepJournal): if supplied, jobs already in the journal are
+            loaded instead of rerun, and newly finished jobs are recorded in it
+            (a journal given as a path is closed at the end)
+        sink (CSVSink/ParquetSink): if supplied, each newly finished job's results are written to it
+        collect (bool): whether to keep the results in memory and return them; set
+            to False with a sink to keep memory flat over large grids
+        sim_fn (func): function run for each job, called as ``sim_fn(county_row, sc_row, rand_seed=seed)``
+            (default: ``county_scenario_sim``); it is sent to the workers, so it must be picklable
+        mp_context (str/context): multiprocessing start method (e.g. "spawn") or context for the
+            worker processes (default: the platform's default)
+
+    Returns:
+        The long DataFrame of S, I, R and new infections for every job, in grid
+        order (or None if collect=False). If any job fails, the others still
+        run and are recorded, and a RuntimeError is raised at the end.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if isinstance(mp_context, str):
+        mp_context = mp.get_context(mp_context)
+    jobs = make_jobs(pars_df, scs, rand_seed=rand_seed)
+    own_journal = isinstance(journal, str)
+    if own_journal:
+        journal = SweepJournal(journal)
+
+    results = [None]*len(jobs)
+    failures = []
+    try:
+        # Skip the jobs that already finished in a previous run
+        if journal is not None:
+            done = journal.done()
+            for job in jobs:
+                if job.key in done and collect:
+                    results[job.job_index] = journal.load(job.key)
+            print(f'Resuming sweep: {len(done & {job.key for job in jobs})} of {len(jobs)} jobs already done')
+        else:
+            done = set()
+        todo = [job for job in jobs if job.key not in done]
+
+        # A failed job doesn't stop the others being recorded as they finish
+        with cf.ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context) as executor:
+            futures = {executor.submit(run_job, job, sim_fn): job for job in todo}
+            for future in cf.as_completed(futures):
+                job = futures[future]
+                try:
+                    df = future.result()
+                except Exception as E:
+                    print(f'Job {job.job_index} ({job.county_row["county"]}, {job.sc_row.to_dict()}) failed: {E}')
+                    failures.append(E)
+                    continue
+                if journal is not None:
+                    journal.record(job.key, df)
+                if sink is not None:
+                    sink.write(df)
+                if collect:
+                    results[job.job_index] = df
+    finally:
+        if sink is not None:
+            sink.close()
+        if own_journal:
+            journal.close()
+
+    if failures:
+        errormsg = f'{len(failures)} of {len(todo)} sweep jobs failed; the rest were recorded, so a rerun with the journal only retries the failed ones'
+        raise RuntimeError(errormsg) from failures[0]
+    if not collect:
+        return None
+    final_results = pd.concat(results).reset_index(drop=True)
+    return final_results
+
+
+if __name__ == '__main__':
+    pars_df = pd.read_csv("pars_df.csv")
+    mcv2_values = np.arange(0, 1.05, 0.1).tolist()
+    mcv2_values = [min(v, 0.95) for v in mcv2_values]  # Limit the values to 0.95
+    scs = pd.DataFrame({
+        'mcv1': [0.95] * len(mcv2_values),
+        'mcv2': mcv2_values
+    })
+
+    county_sim_parallel(pars_df, scs, journal='county_sweep.db', sink=CSVSink('county_sweep.csv'), collect=False)
@@ -1,4 +1,5 @@
 # Modules
+from collections import defaultdict
 import numpy as np
 import sciris as sc
 import matplotlib.pyplot as pl
@@ -6,6 +7,9 @@ import starsim as ss
 from plotnine import *
 import pandas as pd
 import matplotlib.pyplot as plt
+from vaccination import measles_vaccine, measles_routine_vx
+from age_schedule import AgeCrossingSchedule
+from adaptive import tick_dt, pop_buckets
 
 # Data
 kenya_popsize = pd.read_csv("data/ky.csv")
@@ -27,27 +31,97 @@ class SEIR(ss.Infection):
         self.default_pars(
             beta = 1-np.exp(-18/9) ,  # Mean transmission rate: R0 / D
             init_prev = ss.bernoulli(p=.005),
+            init_immune = ss.bernoulli(p=0),  # Share of initial susceptibles who are immune
+            beta_mean = 1-np.exp(-18/9),  # Mean transmission rate of the seasonal forcing
+            beta_amplitude = 0.21,  # Amplitude of seasonal forcing
+            beta_schedule = None,  # Transmission rate for each timestep (array, or function of the sim); if None, seasonal forcing from beta_mean and beta_amplitude
             dur_exp = ss.lognorm_ex(mean=10/12, stdev=2),
             dur_inf = ss.lognorm_ex(mean=9/12, stdev=2),
-            p_death = ss.bernoulli(p=0.018)
+            p_death = ss.bernoulli(p=0.018),
+            immune_age = 100,  # Agents older than this are never infected (None for no age limit)
+            scheduled = False,  # Queue state transitions by timestep instead of scanning all agents
+            compact = False,  # Store timestep indices as int32 rather than float64
 
         )
         self.update_pars(pars, **kwargs)
 
+        # Timestep indices; with compact=True they are int32, rounded up when
+        # set (events happen on the first timestep at or after their time), and
+        # the largest int32 stands for "never"
+        def TiArr(name, label):
+            if self.pars.compact:
+                return ss.Arr(name, dtype=np.int32, nan=np.iinfo(np.int32).max, coerce=False, label=label)
+            return ss.FloatArr(name, label=label)
+
         self.add_states(
             ss.BoolArr('exposed', label='Exposed'),
             ss.BoolArr('recovered', label='Recovered'),
-            ss.FloatArr('ti_exposed', label='Time of exposure'),
-            ss.FloatArr('ti_infectious', label='Time of becoming infectious'),
-            ss.FloatArr('ti_recovered', label='Time of recovery'),
-            ss.FloatArr('ti_dead', label='Time of death'),
+            TiArr('ti_exposed', label='Time of exposure'),
+            TiArr('ti_infectious', label='Time of becoming infectious'),
+            TiArr('ti_recovered', label='Time of recovery'),
+            TiArr('ti_dead', label='Time of death'),
+        )
+
+        # Per-timestep buckets of uids due to transition, used if scheduled=True
+        self.queues = sc.objdict(
+            infectious = defaultdict(list),
+            recovered = defaultdict(list),
+            dead = defaultdict(list),
         )
+        self.immune_schedule = None  # Agents by when they pass immune_age; created on the first timestep
         return
     
     @property
     def infectious(self):
         return self.infected
 
+    def init_post(self):
+        """ Seed the initial infections, then make some of the remaining susceptibles immune """
+        super().init_post()
+        initially_immune = self.pars.init_immune.filter(self.susceptible.uids)
+        self.susceptible[initially_immune] = False
+        self.recovered[initially_immune] = True
+        self.init_schedule()
+        return
+
+    def init_schedule(self):
+        """ Work out the transmission probability per contact for every timestep, once """
+        sim = self.sim
+        p = self.pars
+        if p.beta_schedule is None:
+            beta_rate = p.beta_mean * (1 + p.beta_amplitude * np.cos(2 * np.pi * sim.tivec * sim.dt))
+        elif callable(p.beta_schedule):
+            beta_rate = p.beta_schedule(sim)
+        else:
+            beta_rate = p.beta_schedule
+        beta_rate = np.asarray(beta_rate, dtype=float)
+        if beta_rate.shape != (sim.npts,):
+            errormsg = f'The beta schedule must have one value per timestep ({sim.npts}), not shape {beta_rate.shape}'
+            raise ValueError(errormsg)
+        self.beta_prob = 1 - np.exp(-beta_rate)
+
+        # The betas used by make_new_cases(); updated in place each timestep
+        self.betamap = sc.objdict({key: [0.0, 0.0] for key in sim.networks.keys()})
+        return
+
+    def _check_betas(self):
+        """ Use the betas for this timestep, rather than rebuilding them from the pars """
+        return self.betamap
+
+    def schedule(self, queue, uids, ti_event):
+        """ Add uids to the bucket of the first timestep at which their event is due """
+        ti_due = np.maximum(np.ceil(ti_event), self.sim.ti + 1).astype(int)
+        for ti in np.unique(ti_due):
+            self.queues[queue][ti].append(uids[ti_due == ti])
+        return
+
+    def pop_due(self, queue):
+        """ Remove and return the uids whose event has come due since the previous step """
+        due = pop_buckets(self.queues[queue], self.sim)
+        if not due:
+            return ss.uids()
+        return ss.uids(np.concatenate(due))
+
 
     def update_pre(self):
         """ Update states before the next time step """
@@ -56,33 +130,44 @@ class SEIR(ss.Infection):
         ti = sim.ti
         dt = sim.dt
     
-        # handle beta here: at start of infection prior to transmission
-        beta_mean = 1-np.exp(-18/9)  # Mean transmission rate
-        beta_amplitude = 0.21   #Amplitude of seasonal forcing
-        beta_rate = beta_mean * (1 + beta_amplitude * np.cos(2 * np.pi * ti/12))
-        beta_prob = 1 - np.exp(-beta_rate)
-    
-        # Dynamically get the network keys from the simulation
-        network_keys = self.sim.networks.keys()
-        self.pars.beta = {key: [beta_prob, beta_prob] for key in network_keys}
-
-        # conditions for all older people above 20 years to never get measles
-        all_ids_above_20 = sim.people.uid[sim.people.age > 100]
-        self.susceptible[all_ids_above_20] = False
-        self.recovered[all_ids_above_20] = True
+        # Transmission probability for this timestep, from the precomputed schedule
+        beta_prob = self.beta_prob[ti]
+        for betas in self.betamap.values():
+            betas[0] = betas[1] = beta_prob
+
+        # Agents older than immune_age never get measles; only those who have
+        # passed the age since the last timestep need to be updated
+        if p.immune_age is not None:
+            if self.immune_schedule is None:
+                self.immune_schedule = AgeCrossingSchedule(p.immune_age, strict=True)
+            now_immune = self.immune_schedule.update(sim)
+            self.susceptible[now_immune] = False
+            self.recovered[now_immune] = True
 
         # Progress exposed -> infectious
-        new_infectious = (self.exposed & (self.ti_infectious <= ti) ).uids
+        if p.scheduled:
+            new_infectious = self.pop_due('infectious')
+            new_infectious = new_infectious[self.exposed[new_infectious]]
+        else:
+            new_infectious = (self.exposed & (self.ti_infectious <= ti) ).uids
         self.exposed[new_infectious] = False
         self.infected[new_infectious] = True
 
         # Progress infectious -> recovered
-        recovered = (self.infected & (self.ti_recovered <= ti)).uids
+        if p.scheduled:
+            recovered = self.pop_due('recovered')
+            recovered = recovered[self.infected[recovered]]
+        else:
+            recovered = (self.infected & (self.ti_recovered <= ti)).uids
         self.infected[recovered] = False
         self.recovered[recovered] = True
 
         # Trigger deaths
-        deaths = (self.ti_dead <= ti).uids
+        if p.scheduled:
+            deaths = self.pop_due('dead')
+            deaths = deaths[sim.people.alive[deaths]]
+        else:
+            deaths = (self.ti_dead <= ti).uids
         if len(deaths):
             sim.people.request_death(deaths)
 
@@ -92,7 +177,7 @@ class SEIR(ss.Infection):
         """ Set prognoses """
         super().set_prognoses(uids, source_uids)
         ti = self.sim.ti
-        dt = self.sim.dt
+        dt = tick_dt(self.sim)  # A timestep of the time vector, even during an AdaptiveSim's long steps
         self.susceptible[uids] = False
         self.exposed[uids] = True
         self.ti_exposed[uids] = ti
@@ -104,14 +189,23 @@ class SEIR(ss.Infection):
         dur_inf = p.dur_inf.rvs(uids)
 
         # Set time of becoming infectious
-        self.ti_infectious[uids] = ti + dur_exp / dt
+        ti_infectious = ti + dur_exp / dt
+        self.ti_infectious[uids] = np.ceil(ti_infectious) if p.compact else ti_infectious
 
         # Determine who dies and who recovers and when
         will_die = p.p_death.rvs(uids)
         dead_uids = uids[will_die]
         rec_uids = uids[~will_die]
-        self.ti_dead[dead_uids] = ti + (dur_exp[will_die] + dur_inf[will_die]) / dt
-        self.ti_recovered[rec_uids] = ti + (dur_exp[~will_die] + dur_inf[~will_die]) / dt
+        ti_end = ti + (dur_exp + dur_inf) / dt
+        if p.compact:
+            ti_end = np.ceil(ti_end)
+        self.ti_dead[dead_uids] = ti_end[will_die]
+        self.ti_recovered[rec_uids] = ti_end[~will_die]
+
+        if p.scheduled:
+            self.schedule('infectious', uids, self.ti_infectious[uids])
+            self.schedule('recovered', rec_uids, self.ti_recovered[rec_uids])
+            self.schedule('dead', dead_uids, self.ti_dead[dead_uids])
         return
 
     def update_death(self, uids):
@@ -122,18 +216,29 @@ class SEIR(ss.Infection):
         self.recovered[uids] = False
         return
       
+    def init_results(self):
+        """ Add incidence to the default results, and reset the running totals """
+        super().init_results()
+        self.results += ss.Result(self.name, 'incidence', self.sim.npts, dtype=float, scale=False, label='Incidence per 1,000')
+        self.cum_total = 0
+        return
+
     def update_results(self):
-        super().update_results()
+        # Skip ss.Infection.update_results, which rescans the result history for cum_infections
+        ss.Disease.update_results(self)
         res = self.results
         ti = self.sim.ti
+        n_alive = np.count_nonzero(self.sim.people.alive)
         
         # Count the number of new exposures during this timestep
         new_exposures = np.count_nonzero((self.ti_exposed == ti) & self.exposed)
+        self.cum_total += new_exposures
         
         # Update results accordingly
         res.new_infections[ti] = new_exposures
-        res.cum_infections[ti] = np.sum(res['new_infections'][:ti+1])
-        res.prevalence[ti] = (res.n_infected[ti] + res.n_exposed[ti]) / np.count_nonzero(self.sim.people.alive)
+        res.cum_infections[ti] = self.cum_total
+        res.prevalence[ti] = (res.n_infected[ti] + res.n_exposed[ti]) / n_alive
+        res.incidence[ti] = new_exposures / n_alive * 1000
         return
 
     def plot(self, plot_kw=None):
@@ -148,103 +253,106 @@ class SEIR(ss.Infection):
         sc.boxoff()
         sc.commaticks()
         return fig
-measles = SEIR()
 
-# Interventions -------------------------------------------------------------------------------------------
+if __name__ == '__main__':
 
-my_vax1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
-my_vax2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
+    measles = SEIR()
+
+    # Interventions -------------------------------------------------------------------------------------------
+
+    my_vax1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
+    my_vax2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
+
+    intv1 = measles_routine_vx(
+        name='routine1', 
+        start_year=2020,
+        product=my_vax1,
+        prob=.95,
+        dose = "mcv1"
 
-intv1 = measles_routine_vx(
-    name='routine1', 
-    start_year=2020,
-    product=my_vax1,
-    prob=.95,
-    dose = "mcv1"
-    
-)
-
-intv2 = measles_routine_vx(
-    name='routine2',
-    start_year=2020,
-    product=my_vax2,
-    prob=.95,
-    dose = "mcv2"
-)
-
-intv = [intv1, intv2]
-
-# Parameters -------------------------------------------------------------------------------------------
-
-pars = dict(
-    n_agents = 25_000,     # Number of agents to simulate
-    birth_rate = 27.58,    # parameters for monthly: birth rate 2022 is 27.58
-    death_rate = 7.8,        # parameters for monthly: death rate 2022 is 7.8
-    networks = ss.RandomNet(pars={'n_contacts': 10})
-)
-
-ppl = ss.People(
-    n_agents = 25_000,     # Number of agents to simulate
-    age_data = pop_age
-   
     )
 
-# Simulations -------------------------------------------------------------------------------------------
-
-mysim = ss.Sim(
-    pars = pars, 
-    start = 2020, 
-    people = ppl, 
-    diseases = measles, 
-    interventions = intv,
-    rand_seed = 765,
-    n_years = 10,
-    dt = 1/12
-)
-
-# Running the model -------------------------------------------------------------------------------------------
-
-mysim.run()
-mysim.plot()
-plt.show()
-
-# Consolidating the results -------------------------------------------------------------------------------------------
-
-res = pd.DataFrame({
-    'year': mysim.yearvec,
-    'susceptible': mysim.results.seir.n_susceptible,
-    "Exposed": mysim.results.seir.n_exposed,
-    "Infected": mysim.results.seir.n_infected,
-    "new_infections": mysim.results.seir.new_infections,
-    "Recovered": mysim.results.seir.n_recovered
-})
-res_long = pd.melt(res, id_vars=['year'], var_name='state', value_name='count')
-
-# New infections
-res2 = pd.DataFrame({
-    'year': mysim.yearvec,
-    "new_infections": mysim.results.seir.new_infections,
-})
-
-# Age at vaccination
-age_vaccinated = pd.DataFrame({
-    "age_mcv1": mysim.interventions.routine1.age_at_vaccination*12,
-    "age_mcv2" : mysim.interventions.routine2.age_at_vaccination*12
-    
+    intv2 = measles_routine_vx(
+        name='routine2',
+        start_year=2020,
+        product=my_vax2,
+        prob=.95,
+        dose = "mcv2"
+    )
+
+    intv = [intv1, intv2]
+
+    # Parameters -------------------------------------------------------------------------------------------
+
+    pars = dict(
+        n_agents = 25_000,     # Number of agents to simulate
+        birth_rate = 27.58,    # parameters for monthly: birth rate 2022 is 27.58
+        death_rate = 7.8,        # parameters for monthly: death rate 2022 is 7.8
+        networks = ss.RandomNet(pars={'n_contacts': 10})
+    )
+
+    ppl = ss.People(
+        n_agents = 25_000,     # Number of agents to simulate
+        age_data = pop_age
+
+        )
+
+    # Simulations -------------------------------------------------------------------------------------------
+
+    mysim = ss.Sim(
+        pars = pars, 
+        start = 2020, 
+        people = ppl, 
+        diseases = measles, 
+        interventions = intv,
+        rand_seed = 765,
+        n_years = 10,
+        dt = 1/12
+    )
+
+    # Running the model -------------------------------------------------------------------------------------------
+
+    mysim.run()
+    mysim.plot()
+    plt.show()
+
+    # Consolidating the results -------------------------------------------------------------------------------------------
+
+    res = pd.DataFrame({
+        'year': mysim.yearvec,
+        'susceptible': mysim.results.seir.n_susceptible,
+        "Exposed": mysim.results.seir.n_exposed,
+        "Infected": mysim.results.seir.n_infected,
+        "new_infections": mysim.results.seir.new_infections,
+        "Recovered": mysim.results.seir.n_recovered
+    })
+    res_long = pd.melt(res, id_vars=['year'], var_name='state', value_name='count')
+
+    # New infections
+    res2 = pd.DataFrame({
+        'year': mysim.yearvec,
+        "new_infections": mysim.results.seir.new_infections,
     })
 
+    # Age at vaccination
+    age_vaccinated = pd.DataFrame({
+        "age_mcv1": mysim.people.doses.age_dose1*12,
+        "age_mcv2" : mysim.people.doses.age_dose2*12
+
+        })
 
-# Plotting -------------------------------------------------------------------------------------------
 
-(
- ggplot(res_long, aes(x='year', y='count')) +
- geom_line(aes(color='state'), size = 1) +
- theme_light()
-)
+    # Plotting -------------------------------------------------------------------------------------------
 
+    (
+     ggplot(res_long, aes(x='year', y='count')) +
+     geom_line(aes(color='state'), size = 1) +
+     theme_light()
+    )
 
-(
-  ggplot(res2, aes(x="year", y = "new_infections")) +
-   geom_line(size = 1) +
- theme_light()
-)
+
+    (
+      ggplot(res2, aes(x="year", y = "new_infections")) +
+       geom_line(size = 1) +
+     theme_light()
+    )
@@ -138,100 +138,123 @@ class routine_measles_vx(ss.routine_vx):
     pass
 
 
-# The function for simulating
-def county_sim(pars_df, scs, **kwargs):
-    # Dictionary to accumulate data for all counties and scs combinations
-    all_new_infections = []
-
-    pars = {}
+# Simulating a single county under a single scenario
+def county_scenario_sim(county_row, sc_row, rand_seed=None, **kwargs):
+    """
+    Run one (county, scenario) pair and return its S, I, R and new infections
+    as a long DataFrame tagged with the county and the mcv1/mcv2 coverage.
+    """
+    county_name = county_row['county']
+
+    pars = sc.objdict(
+        n_agents=5000,
+        birth_rate=county_row['birth_rate'],
+        death_rate=county_row['death_rate'],
+        networks=dict(
+            type='randomnet',
+            n_contacts=4
+        )
+    )
+    if rand_seed is not None:
+        pars.rand_seed = rand_seed
 
     def eligibility_mcv2(sim): return (sim.interventions.routine1.n_doses == 1)
     my_vax1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
     my_vax2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
-    my_vax3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95))
-
-    for _, county_row in pars_df.iterrows():
-        county_name = county_row['county']
-
-        pars[county_name] = sc.objdict(
-            n_agents=5000,
-            birth_rate=county_row['birth_rate'],
-            death_rate=county_row['death_rate'],
-            networks=dict(
-                type='randomnet',
-                n_contacts=4
-            )
-        )
 
-        for _, sc_row in scs.iterrows():
-            # The interventions from the vaccine
-            intv1 = routine_measles_vx(
-                name='routine1',
-                start_year=2020,
-                product=my_vax1,
-                prob=sc_row['mcv1']
-            )
-            intv2 = routine_measles_vx(
-                name='routine2',
-                start_year=2020,
-                eligibility=eligibility_mcv2,
-                product=my_vax2,
-                prob=sc_row['mcv2']
-            )
-
-            # The interventions
-            intv = [intv1, intv2]
-
-            # The simulations
-            print(
-                f"\033[92mRunning simulations for county: {county_name} with scs: {sc_row}\033[0m")
-
-            sim_intv = ss.Sim(
-                pars=pars[county_name],
-                diseases=Measles(
-                    beta=.9, init_prev=county_row['initial_prev'], imm_prob=county_row['initial_immunity']),
-                interventions=intv,
-                start=2020,
-                end=2050
-            )
-            sim_intv.run()
-
-            # Collecting data for data_new_infections
-            # Collecting results: number of S, I, R, and new infections
-            data_s = sim_intv.results.measles.n_susceptible
-            data_i = sim_intv.results.measles.n_infected
-            data_r = sim_intv.results.measles.n_recovered
-            data_new_infections = sim_intv.results.measles.new_infections
-
-            # Creating a DataFrame with S, I, R, and new infections
-            df_results = pd.DataFrame({
-                'year': sim_intv.yearvec,
-                'susceptible': data_s,
-                'infected': data_i,
-                'recovered': data_r,
-                'new_infections': data_new_infections,
-                'county': county_name,
-                'mcv1': sc_row['mcv1'],
-                'mcv2': sc_row['mcv2']
-            })
-
-            # Accumulating results
-            all_new_infections.append(df_results)
-        final_results = pd.concat(all_new_infections).reset_index(drop=True)
-    return final_results
+    # The interventions from the vaccine
+    intv1 = routine_measles_vx(
+        name='routine1',
+        start_year=2020,
+        product=my_vax1,
+        prob=sc_row['mcv1']
+    )
+    intv2 = routine_measles_vx(
+        name='routine2',
+        start_year=2020,
+        eligibility=eligibility_mcv2,
+        product=my_vax2,
+        prob=sc_row['mcv2']
+    )
+
+    # The interventions
+    intv = [intv1, intv2]
+
+    # The simulations
+    print(
+        f"\033[92mRunning simulations for county: {county_name} with scs: {sc_row}\033[0m")
+
+    sim_intv = ss.Sim(
+        pars=pars,
+        diseases=Measles(
+            beta=.9, init_prev=county_row['initial_prev'], imm_prob=county_row['initial_immunity']),
+        interventions=intv,
+        start=2020,
+        end=2050
+    )
+    sim_intv.run()
+
+    # Collecting data for data_new_infections
+    # Collecting results: number of S, I, R, and new infections
+    data_s = sim_intv.results.measles.n_susceptible
+    data_i = sim_intv.results.measles.n_infected
+    data_r = sim_intv.results.measles.n_recovered
+    data_new_infections = sim_intv.results.measles.new_infections
+
+    # Creating a DataFrame with S, I, R, and new infections
+    df_results = pd.DataFrame({
+        'year': sim_intv.yearvec,
+        'susceptible': data_s,
+        'infected': data_i,
+        'recovered': data_r,
+        'new_infections': data_new_infections,
+        'county': county_name,
+        'mcv1': sc_row['mcv1'],
+        'mcv2': sc_row['mcv2']
+    })
+    return df_results
 
 
-# res = county_sim(pars_df, scs)
-res_with_immunity = county_sim(pars_df, scs)
+# The function for simulating
+def county_sim(pars_df, scs, sink=None, collect=True, **kwargs):
+    """
+    Run every (county, scenario) pair. If a sink (e.g. county_sweep.CSVSink) is
+    given, each run's results are written to it as soon as the run finishes; with
+    collect=False nothing is kept in memory and None is returned.
+    """
+    # List to accumulate data for all counties and scs combinations
+    all_new_infections = []
+
+    try:
+        for _, county_row in pars_df.iterrows():
+            for _, sc_row in scs.iterrows():
+                df_results = county_scenario_sim(county_row, sc_row, **kwargs)
+                if sink is not None:
+                    sink.write(df_results)
+                # Accumulating results
+                if collect:
+                    all_new_infections.append(df_results)
+    finally:
+        if sink is not None:
+            sink.close()  # Also on failure, so a ParquetSink still writes its footer
+
+    if not collect:
+        return None
+    final_results = pd.concat(all_new_infections).reset_index(drop=True)
+    return final_results
+
 
-pars_df = pd.read_csv("/Users/macuser/Documents/GitHub/ABM/python/pars_df.csv")
-# Extend the range to just above 1, so it includes 0.95
-mcv2_values = np.arange(0, 1.05, 0.1).tolist()
-mcv2_values = [min(v, 0.95) for v in mcv2_values]  # Limit the values to 0.95
+if __name__ == '__main__':
+    pars_df = pd.read_csv("/Users/macuser/Documents/GitHub/ABM/python/pars_df.csv")
+    # Extend the range to just above 1, so it includes 0.95
+    mcv2_values = np.arange(0, 1.05, 0.1).tolist()
+    mcv2_values = [min(v, 0.95) for v in mcv2_values]  # Limit the values to 0.95
 
+    # Create the DataFrame
+    scs = pd.DataFrame({
+        'mcv1': [0.95] * len(mcv2_values),  # Fill the mcv1 column with 0.95
+        'mcv2': mcv2_values                # Use the generated values for mcv2
+    })
 
-# Create the DataFrame
-scs = pd.DataFrame({
-    'mcv1': [0.95] * len(mcv2_values),  # Fill the mcv1 column with 0.95
-    'mcv2': mcv2_values                # Use the generated values for mcv2
-})
+    # res = county_sim(pars_df, scs)
+    res_with_immunity = county_sim(pars_df, scs)
@@ -0,0 +1,97 @@
+"""
+Opt-in timing of the hot paths of a sim
+
+    sim = ss.Sim(...)
+    SimProfiler(sim)
+    sim.run()
+    sim.timings  # One row per timestep, one column per phase, in seconds
+
+Nothing is changed unless a profiler is attached, so there is no cost when
+profiling is not used. When it is, each phase is wrapped with a pair of
+``perf_counter_ns()`` calls that add into a preallocated per-timestep array.
+"""
+
+from time import perf_counter_ns
+import numpy as np
+import pandas as pd
+
+
+class SimProfiler:
+    """
+    Accumulate the time spent in each phase of every timestep of a sim.
+
+    The phases are:
+
+    - ``update_pre``: disease state progression (e.g. ``SEIR.update_pre``)
+    - ``transmission``: ``make_new_cases``, including ``set_prognoses``
+    - ``set_prognoses``: prognoses of new infections
+    - ``update_death``: disease cleanup for agents who died
+    - ``network``: network updates (e.g. ``RandomNet`` regeneration)
+    - ``intervention``: ``apply`` of each intervention (e.g. ``measlesBaseVaccination.apply``)
+    - ``update_results``: people and disease results
+    - ``step``: the whole timestep
+
+    The phases are wrapped when the sim is run (after it is initialized), and the
+    table is stored as ``sim.timings`` when the run finishes. The wrappers are
+    plain functions, so a profiled sim cannot be pickled.
+
+    Args:
+        sim (Sim): the sim to profile
+    """
+
+    phases = ['update_pre', 'transmission', 'set_prognoses', 'update_death', 'network', 'intervention', 'update_results', 'step']
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.ns = None
+        self._run = sim.run
+        sim.run = self.run
+        sim.profiler = self
+        return
+
+    def run(self, *args, **kwargs):
+        """ Wrap the phases (the first time only), run the sim and store the timings """
+        sim = self.sim
+        if not sim.initialized:
+            sim.initialize()
+        if self.ns is None:
+            self.ns = {phase: np.zeros(sim.npts, dtype=np.int64) for phase in self.phases}
+            for disease in sim.diseases():
+                self.wrap(disease, 'update_pre', 'update_pre')
+                self.wrap(disease, 'make_new_cases', 'transmission')
+                self.wrap(disease, 'set_prognoses', 'set_prognoses')
+                self.wrap(disease, 'update_death', 'update_death')
+                self.wrap(disease, 'update_results', 'update_results')
+            for network in sim.networks():
+                self.wrap(network, 'update', 'network')
+            for intervention in sim.interventions():
+                self.wrap(intervention, 'apply', 'intervention')
+            self.wrap(sim.people, 'update_results', 'update_results')
+            self.wrap(sim, 'step', 'step')
+        out = self._run(*args, **kwargs)
+        sim.timings = self.to_df()
+        return out
+
+    def wrap(self, obj, name, phase):
+        """ Replace obj.name with a version that adds its run time to the phase """
+        method = getattr(obj, name)
+        acc = self.ns[phase]
+        sim = self.sim
+        def timed(*args, **kwargs):
+            ti = sim.ti  # Read first, since step() increments it
+            start = perf_counter_ns()
+            out = method(*args, **kwargs)
+            acc[ti] += perf_counter_ns() - start
+            return out
+        setattr(obj, name, timed)
+        return
+
+    def to_df(self):
+        """ Per-timestep timing table, in seconds """
+        df = pd.DataFrame({phase: ns/1e9 for phase, ns in self.ns.items()}, index=self.sim.yearvec)
+        df.index.name = 'year'
+        return df
+
+    def summary(self):
+        """ Total time in each phase, in seconds """
+        return self.to_df().sum()
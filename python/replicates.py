@@ -0,0 +1,177 @@
+"""
+Run many replicates (seeds) of one sim in parallel
+
+    sim = ss.Sim(pars=pars, people=ss.People(n_agents=25_000, age_data=pop_age), diseases=SEIR(), ...)
+    res = run_replicates(sim, seeds=range(20), n_workers=8)
+    res.new_infections  # DataFrame of mean, median and quantile bands by year
+
+The template sim (including its People and the processed age data) is built
+once. Each worker process receives it once when it starts, rather than once per
+seed, and with the fork start method (the default where available) it is
+inherited from the parent without being pickled at all. Each replicate then runs
+on a copy of the template with its own seed.
+
+With ``shared=True``, the template is instead initialized once and its agent
+states are written to a folder of ``.npy`` files (a ``PopulationSnapshot``).
+Workers receive only the small remainder of the sim, and each replicate memory-
+maps the states copy-on-write, so starting a replicate takes milliseconds and
+pages are only copied once a replicate writes to them. All replicates then
+start from the same initial population and infections, and differ only in the
+random numbers drawn from the first timestep on.
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+import concurrent.futures as cf
+import numpy as np
+import pandas as pd
+import sciris as sc
+import starsim as ss
+
+import checkpoint  # noqa: F401 -- lets initialized sims (with results) be pickled to spawned workers
+
+results_keys = ['new_infections', 'prevalence']
+_template = None  # The template sim, set in each worker process
+
+
+class PopulationSnapshot:
+    """
+    An initialized sim whose agent states are stored in memory-mapped .npy files.
+
+    The snapshot itself holds the rest of the sim (modules, networks, results)
+    and the folder path, so it pickles small. Each call to ``load()`` returns a
+    separate sim whose states are mapped copy-on-write from the files.
+
+    Args:
+        sim (Sim): the sim to snapshot (initialized here if it isn't already)
+        folder (str): where to write the states (default: a new temporary folder)
+        headroom (float): spare capacity to add to each state, as a share of its
+            length, so that births fill the mapped arrays rather than forcing
+            starsim to copy them into larger ones
+    """
+
+    def __init__(self, sim, folder=None, headroom=0.5):
+        if not sim.initialized:
+            sim.initialize()
+        self.folder = folder if folder is not None else tempfile.mkdtemp(prefix='population_')
+        os.makedirs(self.folder, exist_ok=True)
+
+        states = self.states(sim)
+        for i, state in enumerate(states):
+            n_extra = int(headroom*state.len_tot)
+            if n_extra:  # As in Arr.grow(), but without adding any agents
+                state.raw = np.concatenate([state.raw, np.empty(n_extra, dtype=state.dtype)])
+                state.len_tot = len(state.raw)
+                state.set_nan(np.arange(state.len_used, state.len_tot))
+            np.save(self.path(i), np.asarray(state.raw))
+
+        # Keep everything else, without the states
+        raws = [state.raw for state in states]
+        for state in states:
+            state.raw = None
+        self.sim = sc.dcp(sim)
+        for state, raw in zip(states, raws):
+            state.raw = raw
+        return
+
+    @staticmethod
+    def states(sim):
+        """ Every agent state in the sim, in a fixed order """
+        people = sim.people
+        return [people.uid, people.slot] + list(people._states.values())
+
+    def path(self, i):
+        return os.path.join(self.folder, f'state{i}.npy')
+
+    def load(self, rand_seed=None):
+        """ A new sim using the stored states, optionally with new random number streams """
+        sim = sc.dcp(self.sim)
+        for i, state in enumerate(self.states(sim)):
+            raw = np.load(self.path(i), mmap_mode='c').view(np.ndarray)
+            state.raw = raw.view(ss.uids) if isinstance(state, ss.IndexArr) else raw
+        if rand_seed is not None:
+            sim.pars.rand_seed = rand_seed
+            for dist in sim.dists.dists.values():
+                dist.seed = None  # Otherwise a seed of 0 would be added to the old seed
+            sim.dists = ss.Dists(obj=sim)  # Empty container, so the old one isn't searched for dists
+            sim.dists.initialize(base_seed=rand_seed, force=True)
+        return sim
+
+    def cleanup(self):
+        """ Delete the folder of states """
+        shutil.rmtree(self.folder, ignore_errors=True)
+        return
+
+
+def _init_worker(sim):
+    global _template
+    _template = sim
+    return
+
+
+def run_replicate(seed, disease='seir', keys=results_keys):
+    """ Run one replicate of the template sim (or snapshot) and return its results """
+    if isinstance(_template, PopulationSnapshot):
+        sim = _template.load(rand_seed=seed)
+    else:
+        sim = sc.dcp(_template)
+        sim.pars.rand_seed = seed
+    sim.run(verbose=0)
+    out = {key: np.array(sim.results[disease][key]) for key in keys}
+    out['year'] = np.array(sim.yearvec)
+    return out
+
+
+def summarize(arrs, year, quantiles=(0.05, 0.95)):
+    """ Mean, median and quantile bands across replicates (rows) by year """
+    df = pd.DataFrame({
+        'year': year,
+        'mean': arrs.mean(axis=0),
+        'median': np.median(arrs, axis=0),
+    })
+    for q in quantiles:
+        df[f'q{q*100:g}'] = np.quantile(arrs, q, axis=0)
+    return df
+
+
+def run_replicates(sim, seeds, n_workers=None, disease='seir', keys=results_keys, quantiles=(0.05, 0.95), shared=False):
+    """
+    Run a sim once for each seed, in parallel, and summarize the results.
+
+    Args:
+        sim (Sim): the template sim (not yet run)
+        seeds (list): random seeds, one per replicate
+        n_workers (int): number of worker processes (default: number of CPUs)
+        disease (str): name of the disease whose results to collect
+        keys (list): results to collect
+        quantiles (tuple): quantiles to report alongside the mean and median
+        shared (bool): share one initialized population between the workers via a
+            PopulationSnapshot (note: all replicates then start from the same state)
+
+    Returns:
+        An objdict with one summary DataFrame per result key, plus ``raw``, the
+        per-replicate arrays (replicates x timesteps) for each key
+    """
+    seeds = list(seeds)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    template = PopulationSnapshot(sc.dcp(sim)) if shared else sim
+    executor = cf.ProcessPoolExecutor(max_workers=min(n_workers, len(seeds)), mp_context=mp.get_context(method),
+                                      initializer=_init_worker, initargs=(template,))
+    try:
+        with executor:
+            reps = list(executor.map(run_replicate, seeds, [disease]*len(seeds), [keys]*len(seeds)))
+    finally:
+        if shared:
+            template.cleanup()
+
+    out = sc.objdict(raw=sc.objdict())
+    year = reps[0]['year']
+    for key in keys:
+        arrs = np.vstack([rep[key] for rep in reps])
+        out.raw[key] = arrs
+        out[key] = summarize(arrs, year, quantiles=quantiles)
+    return out
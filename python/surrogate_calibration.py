@@ -0,0 +1,268 @@
+"""
+Surrogate-assisted calibration of the measles SEIR model
+
+Instead of running a full agent-based sim for every trial, a Gaussian-process
+emulator of the loss is fitted over (beta, init_prev, initial immunity, seasonal
+amplitude) from a small space-filling design. Further full sims are then only
+run where the emulator says the loss could still be lower than the best found
+so far, i.e. where it is uncertain or promising, and the emulator is refitted
+after each batch.
+
+    calib = SurrogateCalibration(eval_fn=measles_loss, bounds=default_bounds)
+    calib.run()
+    calib.best  # Best parameters found by a full sim
+
+Every full evaluation is kept in ``calib.trials``, and can also be added as a
+trial to an Optuna study (e.g. ``sqlite:///starsim_calibration.db``).
+"""
+
+import numpy as np
+import pandas as pd
+import sciris as sc
+
+default_bounds = sc.objdict(
+    beta = [0.5, 1.0],              # Mean transmission rate of the seasonal forcing
+    init_prev = [0.0005, 0.01],     # Initial prevalence
+    init_immune = [0.3, 0.9],       # Share of the initial susceptibles who are immune
+    beta_amplitude = [0.0, 0.5],    # Amplitude of seasonal forcing
+)
+
+
+class GaussianProcess:
+    """
+    Gaussian-process regression with a squared-exponential kernel.
+
+    Inputs are expected to be scaled to the unit cube and outputs are
+    standardized internally. The length scale and noise are picked by maximizing
+    the log marginal likelihood over a small grid.
+
+    Args:
+        length_scales (list): candidate length scales
+        noises (list): candidate noise variances (relative to the standardized output)
+    """
+
+    def __init__(self, length_scales=(0.1, 0.2, 0.3, 0.5, 0.8, 1.2), noises=(1e-6, 1e-3, 1e-2, 1e-1)):
+        self.length_scales = length_scales
+        self.noises = noises
+        return
+
+    @staticmethod
+    def kernel(A, B, length_scale):
+        d2 = ((A[:, None, :] - B[None, :, :])**2).sum(axis=-1)
+        return np.exp(-0.5*d2/length_scale**2)
+
+    def fit(self, X, y):
+        """ Fit to inputs X (n x d, in the unit cube) and outputs y (n) """
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_std = y.std() or 1.0
+        z = (y - self.y_mean)/self.y_std
+
+        best = None
+        for ls in self.length_scales:
+            for noise in self.noises:
+                K = self.kernel(self.X, self.X, ls) + noise*np.eye(len(z))
+                try:
+                    L = np.linalg.cholesky(K)
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = np.linalg.solve(L.T, np.linalg.solve(L, z))
+                loglik = -0.5*z @ alpha - np.log(np.diag(L)).sum()
+                if best is None or loglik > best[0]:
+                    best = (loglik, ls, noise, L, alpha)
+
+        _, self.length_scale, self.noise, self.L, self.alpha = best
+        return self
+
+    def predict(self, X):
+        """ Return the predicted mean and standard deviation at X """
+        Ks = self.kernel(np.asarray(X, dtype=float), self.X, self.length_scale)
+        mean = Ks @ self.alpha
+        v = np.linalg.solve(self.L, Ks.T)
+        var = np.maximum(1 + self.noise - (v**2).sum(axis=0), 1e-12)
+        return mean*self.y_std + self.y_mean, np.sqrt(var)*self.y_std
+
+
+class SurrogateCalibration:
+    """
+    Calibrate by fitting an emulator of the loss and only running full sims
+    where the emulator is uncertain or promising.
+
+    Args:
+        eval_fn (func): takes a dict of parameters and returns the loss of a full sim
+        bounds (dict): lower and upper bound for each parameter
+        n_init (int): size of the initial Latin hypercube design
+        n_iter (int): maximum number of further full evaluations
+        batch_size (int): full evaluations per emulator refit
+        n_candidates (int): random points at which the emulator is queried each round
+        kappa (float): how many standard deviations below the emulator mean a point
+            has to be able to reach to be worth a full sim
+        tol (float): stop once no candidate can improve on the best loss by more than this
+        storage (str): optional Optuna storage URL to also record each full sim as a trial
+        study_name (str): Optuna study name, if storage is given
+        rand_seed (int): seed for the design and candidate points
+    """
+
+    def __init__(self, eval_fn, bounds=None, n_init=20, n_iter=40, batch_size=4, n_candidates=5000,
+                 kappa=2.0, tol=0.0, storage=None, study_name='starsim_calibration', rand_seed=1):
+        self.eval_fn = eval_fn
+        self.bounds = sc.objdict(bounds if bounds is not None else default_bounds)
+        self.keys = list(self.bounds.keys())
+        self.lower = np.array([self.bounds[k][0] for k in self.keys], dtype=float)
+        self.upper = np.array([self.bounds[k][1] for k in self.keys], dtype=float)
+        self.n_init = n_init
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.n_candidates = n_candidates
+        self.kappa = kappa
+        self.tol = tol
+        self.rng = np.random.default_rng(rand_seed)
+        self.study = self._load_study(storage, study_name) if storage else None
+        self.X = []  # Evaluated points, in the unit cube
+        self.y = []  # Their losses
+        self.gp = None
+        return
+
+    def _load_study(self, storage, study_name):
+        try:
+            import optuna
+        except ImportError as E:
+            errormsg = 'Recording trials to a study requires optuna (pip install optuna)'
+            raise ImportError(errormsg) from E
+        return optuna.create_study(storage=storage, study_name=study_name, load_if_exists=True)
+
+    def to_pars(self, x):
+        """ Convert a point in the unit cube to a parameter dict """
+        vals = self.lower + x*(self.upper - self.lower)
+        return sc.objdict({k: float(v) for k, v in zip(self.keys, vals)})
+
+    def latin_hypercube(self, n):
+        """ Space-filling design of n points in the unit cube """
+        d = len(self.keys)
+        perms = np.argsort(self.rng.random((n, d)), axis=0)
+        return (perms + self.rng.random((n, d)))/n
+
+    def evaluate(self, x):
+        """ Run a full sim at x and record the result """
+        pars = self.to_pars(x)
+        loss = float(self.eval_fn(pars))
+        self.X.append(x)
+        self.y.append(loss)
+        if self.study is not None:
+            import optuna
+            distributions = {k: optuna.distributions.FloatDistribution(*self.bounds[k]) for k in self.keys}
+            self.study.add_trial(optuna.trial.create_trial(params=dict(pars), distributions=distributions, value=loss))
+        return loss
+
+    def propose(self):
+        """
+        Fit the emulator and pick the next batch of points: those whose lower
+        confidence bound is lowest, i.e. where a full sim is most likely to
+        improve on the best loss so far. Returns None if no point can improve by
+        more than tol.
+        """
+        self.gp = GaussianProcess().fit(np.array(self.X), np.array(self.y))
+        candidates = self.rng.random((self.n_candidates, len(self.keys)))
+        mean, std = self.gp.predict(candidates)
+        lcb = mean - self.kappa*std
+        if lcb.min() >= min(self.y) - self.tol:
+            return None
+        order = np.argsort(lcb)[:self.batch_size]
+        return candidates[order]
+
+    def run(self, verbose=True):
+        """ Run the initial design, then the emulator-guided evaluations """
+        for x in self.latin_hypercube(self.n_init):
+            self.evaluate(x)
+        if verbose:
+            print(f'Initial design: best loss {min(self.y):0.4g} from {len(self.y)} sims')
+
+        n_done = 0
+        while n_done < self.n_iter:
+            batch = self.propose()
+            if batch is None:
+                if verbose: print('Emulator cannot improve on the best loss; stopping')
+                break
+            for x in batch[:self.n_iter - n_done]:
+                self.evaluate(x)
+                n_done += 1
+            if verbose:
+                print(f'Round done: best loss {min(self.y):0.4g} from {len(self.y)} sims')
+        return self
+
+    @property
+    def trials(self):
+        """ All full evaluations, as a DataFrame """
+        df = pd.DataFrame([self.to_pars(x) for x in self.X])
+        df['loss'] = self.y
+        return df
+
+    @property
+    def best(self):
+        """ Parameters of the best full evaluation """
+        return self.to_pars(self.X[int(np.argmin(self.y))])
+
+
+def make_calibration_sim(pars, n_agents=10_000, total_pop=None, birth_rate=27.58, death_rate=7.8,
+                         n_years=4, rand_seed=1, init_prev=None):
+    """
+    Build an SEIR sim from a dict of calibration parameters (see default_bounds).
+
+    The initial infections are drawn with ss.bernoulli(p=pars['init_prev']), unless
+    a different distribution is given as init_prev.
+    """
+    import starsim as ss
+    from major_improvement import SEIR, pop_age
+
+    sim = ss.Sim(
+        pars = dict(
+            n_agents = n_agents,
+            total_pop = total_pop,
+            birth_rate = birth_rate,
+            death_rate = death_rate,
+            networks = ss.RandomNet(pars={'n_contacts': 10}),
+        ),
+        start = 2020,
+        people = ss.People(n_agents=n_agents, age_data=pop_age),
+        diseases = SEIR(
+            beta_mean = pars['beta'],
+            beta_amplitude = pars['beta_amplitude'],
+            init_prev = ss.bernoulli(p=pars['init_prev']) if init_prev is None else init_prev,
+            init_immune = ss.bernoulli(p=pars['init_immune']),
+        ),
+        rand_seed = rand_seed,
+        n_years = n_years,
+        dt = 1/12,
+        verbose = 0,
+    )
+    return sim
+
+
+def series_loss(model, cases):
+    """ Mean squared error between log model new infections and log reported cases, over their common length """
+    model = np.asarray(model, dtype=float)
+    cases = np.asarray(cases, dtype=float)
+    n = min(len(model), len(cases))
+    keep = ~np.isnan(cases[:n])
+    return np.mean((np.log1p(model[:n][keep]) - np.log1p(cases[:n][keep]))**2)
+
+
+def measles_loss(pars, data_path='data/clean_kenya_measles.csv', n_agents=10_000, n_years=4, rand_seed=1):
+    """
+    Run the SEIR model with the given calibration parameters and return the loss
+    against the national monthly reported cases.
+    """
+    from major_improvement import kenya_popsize
+
+    data = pd.read_csv(data_path)
+    sim = make_calibration_sim(pars, n_agents=n_agents, total_pop=kenya_popsize.n_alive.iloc[0],
+                               n_years=n_years, rand_seed=rand_seed)
+    sim.run()
+    return series_loss(sim.results.seir.new_infections, data.cases.values)
+
+
+if __name__ == '__main__':
+    calib = SurrogateCalibration(eval_fn=measles_loss, storage='sqlite:///starsim_calibration.db')
+    calib.run()
+    print(calib.best)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live as flat scripts in python/, and some read data/ relative to it
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+os.chdir(os.path.dirname(here))
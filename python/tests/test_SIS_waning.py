@@ -0,0 +1,75 @@
+import numpy as np
+
+import SIS_waning as sis
+
+
+def make_dense_contacts(x, y, n_contacts, distance):
+    """ Score every pair, as make_contacts() did before it searched by radius """
+    N = len(x)
+    dist = 1 + np.hypot(x[:,None] - x[None,:], y[:,None] - y[None,:])/distance
+    np.fill_diagonal(dist, np.inf)
+    scores = dist/np.random.rand(N, N)
+    inds = np.argsort(scores, axis=None)[:int(N*n_contacts/2)]
+    return np.vstack(np.unravel_index(inds, scores.shape)).T
+
+
+def contact_stats(make, N, n_contacts, distance, reps=20):
+    """ Mean and 90th percentile of the contact distances, and the mean, SD and share of zeros of the degrees, over fixed seeds """
+    out = []
+    for seed in range(reps):
+        np.random.seed(seed)
+        x, y = np.random.rand(N, 2).T
+        contacts = make(x, y, n_contacts, distance)
+        d = np.hypot(x[contacts[:,0]] - x[contacts[:,1]], y[contacts[:,0]] - y[contacts[:,1]])
+        degree = np.bincount(contacts.ravel(), minlength=N)
+        out.append([d.mean(), np.percentile(d, 90), degree.mean(), degree.std(), np.mean(degree == 0)])
+    return np.mean(out, axis=0)
+
+
+def test_contacts_match_dense():
+    for N, n_contacts, distance in [(300, 10, 0.1), (500, 4, 0.02)]:
+        dense = contact_stats(make_dense_contacts, N, n_contacts, distance)
+        for max_pairs in [None, 50]:
+            stats = contact_stats(lambda *args: sis.make_contacts(*args, max_pairs=max_pairs), N, n_contacts, distance)
+            np.testing.assert_allclose(stats[:4], dense[:4], rtol=0.02, err_msg=f'N={N}, max_pairs={max_pairs}')
+            np.testing.assert_allclose(stats[4], dense[4], atol=0.01, err_msg=f'N={N}, max_pairs={max_pairs}')
+
+
+def test_vector_infections_match_sequential():
+    """ Given the same draws, VectorSim infects the same agents as checking the contacts one at a time, as Sim does """
+    for seed in range(10):
+        sim = sis.VectorSim(N=300, seed=seed, I0=5, beta=2.0, save_full=False)
+        for t in range(20):
+            S, I, imm = sim.S_state.copy(), sim.I_state.copy(), sim.imm.copy()
+            state = np.random.get_state()
+            sim.check_infections(t)
+
+            # VectorSim draws one number per check of a contact whose target was susceptible at the start of the step
+            np.random.set_state(state)
+            checks = [(p1, p2) for p1, p2 in sim.contacts for p1, p2 in [(p1, p2), (p2, p1)]]
+            draws = iter(np.random.rand(sum(S[target] for target, _ in checks)))
+            hits = [next(draws) < sim.pars.beta*sim.pars.dt*(1 - imm[target]) if S[target] else False for target, _ in checks]
+            for (target, source), hit in zip(checks, hits):
+                if S[target] and I[source] and hit:
+                    S[target], I[target] = False, True
+            np.testing.assert_array_equal(sim.I_state, I, err_msg=f'seed={seed}, t={t}')
+
+            sim.check_recoveries(t)
+            sim.check_immunities(t)
+
+
+def test_vector_sim_matches_sim():
+    """ Sim and VectorSim build the same network, and give the same epidemic on average """
+    kwargs = dict(N=200, npts=60, save_full=False)
+    I = []
+    for seed in range(20):
+        sim = sis.Sim(seed=seed, **kwargs)
+        vsim = sis.VectorSim(seed=seed, **kwargs)
+        np.testing.assert_array_equal(sim.contacts, vsim.contacts)
+        sim.run()
+        vsim.run()
+        I.append([sim.I, vsim.I])
+    I = np.array(I)
+    assert I[:, 0, -1].mean() > 50
+    np.testing.assert_allclose(I[:, 0, :30].mean(), I[:, 1, :30].mean(), rtol=0.05)  # Epidemic growth
+    np.testing.assert_allclose(I[:, 0, 30:].mean(), I[:, 1, 30:].mean(), rtol=0.05)  # Endemic level
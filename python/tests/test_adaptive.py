@@ -0,0 +1,76 @@
+import numpy as np
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx, measles_campaign_vx, dose_windows
+from adaptive import AdaptiveSim
+
+
+def make_sim(cls=ss.Sim, n_agents=5000, rand_seed=1, init_prev=0.002, disease_pars=None, sia=True, **kwargs):
+    v1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85, waning=0.05))
+    v2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99, waning=0.05))
+    v3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95, waning=0.05))
+    intv = [
+        measles_routine_vx(name='routine1', start_year=2020, product=v1, prob=0.95, dose='mcv1'),
+        measles_routine_vx(name='routine2', start_year=2020, product=v2, prob=0.95, dose='mcv2'),
+    ]
+    if sia:
+        intv.append(measles_campaign_vx(name='SIA', years=[2023.3], prob=0.9, product=v3))  # Not at the start of a reporting period
+    pars = dict(n_agents=n_agents, birth_rate=27.58, death_rate=7.8, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    disease = SEIR(pars=disease_pars, scheduled=True, init_prev=ss.bernoulli(p=init_prev))
+    sim = cls(pars=pars, start=2020, people=ss.People(n_agents=n_agents, age_data=pop_age), diseases=disease,
+              interventions=intv, rand_seed=rand_seed, n_years=6, dt=1/48, verbose=0, **kwargs)
+    return sim
+
+
+def test_short_steps_match_sim():
+    """ With only short steps, an AdaptiveSim is exactly the same as a Sim """
+    sim = make_sim().run()
+    adaptive = make_sim(AdaptiveSim, n_substeps=4, fine_prevalence=0).run()
+    assert sim.results.seir.cum_infections[-1] > 0
+    assert np.all(adaptive.results.step_ticks == 1)
+    np.testing.assert_array_equal(sim.results.n_alive, adaptive.results.n_alive)
+    for key in sim.results.seir.keys():
+        np.testing.assert_array_equal(sim.results.seir[key], adaptive.results.seir[key], err_msg=key)
+    np.testing.assert_array_equal(sim.diseases.seir.rel_sus.values, adaptive.diseases.seir.rel_sus.values)
+
+
+def test_long_steps():
+    """ With only long steps, infections still last as long and doses are still given as often """
+    dur_exp, dur_inf = 10/12, 9/12
+    disease_pars = dict(dur_exp=ss.lognorm_ex(mean=dur_exp, stdev=0.1), dur_inf=ss.lognorm_ex(mean=dur_inf, stdev=0.1))
+    sim = make_sim(AdaptiveSim, n_substeps=4, fine_prevalence=1, disease_pars=disease_pars).run()
+    assert sim.results.step_ticks.sum() == sim.npts
+    assert np.all(sim.results.step_ticks[:-1:4] == 4) and np.all(sim.results.step_ticks[sim.results.step_ticks != 4] <= 1)
+
+    # Prognoses are in timesteps of the time vector, not of the long steps
+    seir = sim.diseases.seir
+    exposed = ~np.isnan(seir.ti_exposed.raw)
+    assert exposed.sum() > 100
+    np.testing.assert_allclose(np.nanmean((seir.ti_infectious.raw - seir.ti_exposed.raw)[exposed])*sim.dt, dur_exp, rtol=0.05)
+    ti_end = np.fmin(seir.ti_recovered.raw, seir.ti_dead.raw)
+    np.testing.assert_allclose(np.nanmean((ti_end - seir.ti_exposed.raw)[exposed])*sim.dt, dur_exp + dur_inf, rtol=0.05)
+
+    # Children born during the sim get each routine dose with the probability for the timesteps they spend in its age window
+    sim = make_sim(AdaptiveSim, n_substeps=4, fine_prevalence=1, init_prev=0, sia=False).run()
+    children = (np.asarray(sim.people.auids) >= 5000) & (sim.people.age.values >= 2)
+    n_doses = sim.people.doses.n_doses.values[children]
+    expected = 1
+    for dose, (age_min, age_max) in dose_windows.items():
+        n_ticks = round((age_max - age_min)/sim.dt) + 1
+        expected *= 1 - 0.05**(n_ticks*sim.dt)
+        np.testing.assert_allclose(np.mean(n_doses >= dose), expected, atol=0.04, err_msg=f'MCV{dose}')
+
+
+def test_report_and_until():
+    sim = make_sim(AdaptiveSim, n_substeps=4, fine_prevalence=0.01)
+    sim.run(until=10)
+    assert sim.ti == 10  # Not the end of the reporting period
+    sim.run()
+    assert 0 < (sim.results.step_ticks > 1).sum() < (sim.results.step_ticks == 1).sum()
+
+    df = sim.report()
+    assert len(df) == np.ceil(sim.npts/4)
+    np.testing.assert_array_equal(df.year, sim.yearvec[::4])
+    assert df.new_infections.sum() == sim.results.seir.new_infections.sum()
+    np.testing.assert_array_equal(df.prevalence[:-1], sim.results.seir.prevalence[3:-1:4])
@@ -0,0 +1,59 @@
+import numpy as np
+import starsim as ss
+
+from age_schedule import AgeCrossingSchedule, AgeWindowIndex
+
+
+def make_sim(n_agents=2000, dt=1/12, rand_seed=1):
+    """ Small sim with births and deaths, so agents enter and leave during the run """
+    sim = ss.Sim(
+        n_agents = n_agents,
+        demographics = [ss.Births(pars={'birth_rate': 30}), ss.Deaths(pars={'death_rate': 20})],
+        start = 2020,
+        n_years = 4,
+        dt = dt,
+        rand_seed = rand_seed,
+        verbose = 0,
+    )
+    sim.initialize()
+    return sim
+
+
+def set_exact_ages(sim, age, n=50):
+    """ Give some agents ages that reach the threshold exactly k timesteps from now """
+    uids = sim.people.auids[:n]
+    sim.people.age[uids] = age - (np.arange(n) % 12)*sim.dt
+    return uids
+
+
+def test_crossing_schedule_matches_brute_force():
+    for strict in [False, True]:
+        age = 1.5
+        sim = make_sim()
+        set_exact_ages(sim, age)
+        schedule = AgeCrossingSchedule(age, strict=strict)
+        returned = set()
+        while not sim.complete:
+            due = schedule.update(sim)
+            auids = sim.people.auids
+            ages = sim.people.age[auids]
+            crossed = ages > age if strict else ages >= age
+            expected = set(auids[crossed].tolist()) - returned
+            assert set(due.tolist()) == expected, f'ti={sim.ti}, strict={strict}'
+            returned |= expected
+            sim.step()
+
+
+def test_window_index_matches_brute_force():
+    age_min, age_max = 9/12, 12/12
+    sim = make_sim()
+    set_exact_ages(sim, age_min)
+    set_exact_ages(sim, age_max, n=25)  # Some of these leave the window exactly on a step
+    index = AgeWindowIndex(age_min, age_max)
+    while not sim.complete:
+        in_window = index.update(sim)
+        auids = sim.people.auids
+        ages = sim.people.age[auids]
+        expected = auids[(ages >= age_min) & (ages <= age_max)]
+        np.testing.assert_array_equal(np.asarray(in_window), np.asarray(expected), err_msg=f'ti={sim.ti}')
+        sim.step()
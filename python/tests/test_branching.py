@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx, measles_campaign_vx
+from branching import fork
+
+
+def make_sim(waning=0, n_agents=3000, rand_seed=1):
+    v1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85, waning=waning))
+    v2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99, waning=waning))
+    v3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95, waning=waning))
+    intv = [
+        measles_routine_vx(name='routine1', start_year=2020, product=v1, prob=0.95, dose='mcv1'),
+        measles_routine_vx(name='routine2', start_year=2020, product=v2, prob=0.95, dose='mcv2'),
+        measles_campaign_vx(name='SIA', years=[2024], prob=0.95, product=v3),
+    ]
+    pars = dict(n_agents=n_agents, birth_rate=27.58, death_rate=7.8, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    sim = ss.Sim(pars=pars, start=2020, people=ss.People(n_agents=n_agents, age_data=pop_age),
+                 diseases=SEIR(init_prev=ss.bernoulli(p=0.01)), interventions=intv,
+                 rand_seed=rand_seed, n_years=6, dt=1/12, verbose=0)
+    return sim
+
+
+def test_fork_delivery_arms():
+    """ Arms can change a routine intervention's years, its start and end years, or just its prob """
+    arms = dict(
+        years = {'routine2': dict(years=[2024, 2025], prob=0.5)},
+        start_end = {'routine2': dict(start_year=2024, end_year=2025, prob=0.5)},
+        prob = {'routine2': dict(prob=0.5)},
+    )
+    sims = fork(make_sim(), arms, year=2023)
+    ti = sims.years.ti
+    for label in ['years', 'start_end']:
+        intv = sims[label].interventions.routine2
+        assert intv.start_year == 2024 and intv.end_year == 2025, label
+        assert intv.start_point == ti + 12 and intv.end_point == ti + 35, label
+        assert len(intv.prob) == len(intv.timepoints), label
+    intv = sims.prob.interventions.routine2
+    assert intv.start_point == 0 and intv.end_year == 2026
+    np.testing.assert_allclose(intv.prob, 1 - 0.5**(1/12))
+
+    for label, sim in sims.items():
+        sim.run()
+        doses = sim.people.doses
+        second = (doses.n_doses.raw == 2) & (doses.ti_last_dose.raw >= ti)
+        given = np.unique(doses.ti_last_dose.raw[second])
+        if label == 'prob':
+            assert given.min() < ti + 12, label
+        else:
+            assert given.min() >= ti + 12 and given.max() <= ti + 35, label  # Only the SIA gives a second dose after 2025
+
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_unchanged_arm_matches_straight_run(shared):
+    """ An arm with no changes continues exactly as the sim would have without the fork """
+    straight = make_sim(waning=0.05).run()
+    sims = fork(make_sim(waning=0.05), [{}], year=2023, shared=shared)
+    arm = sims[0].run()
+    assert straight.results.seir.cum_infections[-1] > 0
+    for key in straight.results.seir.keys():
+        np.testing.assert_array_equal(straight.results.seir[key], arm.results.seir[key], err_msg=key)
+    np.testing.assert_array_equal(np.asarray(straight.people.auids), np.asarray(arm.people.auids))
+    np.testing.assert_array_equal(straight.diseases.seir.rel_sus.values, arm.diseases.seir.rel_sus.values)  # Shared arms have spare capacity, so not .raw
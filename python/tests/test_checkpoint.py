@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx, measles_campaign_vx
+from checkpoint import save_checkpoint, load_checkpoint
+
+
+def make_sim(waning=None, sia=False, n_agents=3000, rand_seed=1):
+    v1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85, waning=waning))
+    v2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99, waning=waning))
+    intv = [
+        measles_routine_vx(name='routine1', start_year=2020, product=v1, prob=0.95, dose='mcv1'),
+        measles_routine_vx(name='routine2', start_year=2020, product=v2, prob=0.95, dose='mcv2'),
+    ]
+    if sia:
+        v3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95, waning=waning))
+        intv.append(measles_campaign_vx(name='SIA', years=[2022, 2025], prob=0.9, product=v3))  # One campaign before the checkpoint, one after
+    pars = dict(n_agents=n_agents, birth_rate=27.58, death_rate=7.8, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    sim = ss.Sim(pars=pars, start=2020, people=ss.People(n_agents=n_agents, age_data=pop_age),
+                 diseases=SEIR(init_prev=ss.bernoulli(p=0.01)), interventions=intv,
+                 rand_seed=rand_seed, n_years=6, dt=1/12, verbose=0)
+    return sim
+
+
+@pytest.mark.parametrize('waning, sia', [(None, False), (0.05, True)])
+def test_checkpoint_matches_straight_run(tmp_path, waning, sia):
+    """ A sim saved part-way, loaded and finished gives exactly the same results as one run straight through """
+    straight = make_sim(waning=waning, sia=sia).run()
+    filename = save_checkpoint(make_sim(waning=waning, sia=sia), str(tmp_path/'burnin.sim'), year=2023.5)
+    sim = load_checkpoint(filename)
+    assert sim.yearvec[sim.ti] == pytest.approx(2023.5)
+    sim.run()
+    assert straight.results.seir.cum_infections[-1] > 0
+    np.testing.assert_array_equal(straight.results.n_alive, sim.results.n_alive)
+    for key in straight.results.seir.keys():
+        np.testing.assert_array_equal(straight.results.seir[key], sim.results.seir[key], err_msg=key)
+    np.testing.assert_array_equal(np.asarray(straight.people.auids), np.asarray(sim.people.auids))
+    np.testing.assert_array_equal(straight.diseases.seir.rel_sus.values, sim.diseases.seir.rel_sus.values)
+    np.testing.assert_array_equal(straight.people.doses.n_doses.values, sim.people.doses.n_doses.values)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx, measles_campaign_vx
+from compartmental import CompartmentalSim
+from chain_binomial import ChainBinomialSim
+
+
+def make_interventions(leaky):
+    v1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85, leaky=leaky))
+    v2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99, leaky=leaky))
+    v3 = measles_vaccine(name='vax3', pars=dict(efficacy=0.95, leaky=leaky))
+    return [
+        measles_routine_vx(name='routine1', start_year=2020, product=v1, prob=0.95, dose='mcv1'),
+        measles_routine_vx(name='routine2', start_year=2020, product=v2, prob=0.95, dose='mcv2'),
+        measles_campaign_vx(name='SIA', years=[2022, 2025], prob=0.95, product=v3),  # Reaches strata already fully protected
+    ]
+
+
+@pytest.mark.parametrize('engine', [CompartmentalSim, ChainBinomialSim])
+@pytest.mark.parametrize('leaky', [True, False])
+def test_population_conserved(engine, leaky):
+    """ With no births or deaths, vaccination only moves people between strata """
+    pars = dict(n_agents=100_000, birth_rate=0, death_rate=0, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    sim = engine(pars=pars, age_data=pop_age, diseases=SEIR(p_death=ss.bernoulli(p=0)),
+                 interventions=make_interventions(leaky), start=2020, n_years=10, dt=1/12)
+    sim.run()
+    assert sim.results.seir.cum_infections[-1] > 0
+    if not leaky:
+        assert any(key[1] == 0 and key[0] >= 2 for key in sim.strata)  # Later doses reach people already fully protected
+    np.testing.assert_allclose(sim.results.n_alive, sim.results.n_alive[0], rtol=1e-9)
@@ -0,0 +1,63 @@
+import functools
+import numpy as np
+import pandas as pd
+import pytest
+
+import county_sweep
+
+
+def fake_scenario_sim(county_row, sc_row, rand_seed=None):
+    """ Stand-in for county_scenario_sim: a few years of seeded results in the same layout """
+    rng = np.random.default_rng(rand_seed)
+    return pd.DataFrame({
+        'year': np.arange(2020, 2025),
+        'new_infections': rng.poisson(10, 5).astype(float),
+        'county': county_row['county'],
+        'mcv1': sc_row['mcv1'],
+        'mcv2': sc_row['mcv2'],
+    })
+
+
+def make_grid():
+    pars_df = pd.DataFrame({'county': ['Kisumu', 'Turkana'], 'birth_rate': [30.0, 35.0], 'death_rate': [7.0, 8.0]})
+    scs = pd.DataFrame({'mcv1': [0.95, 0.95], 'mcv2': [0.0, 0.5]})
+    return pars_df, scs
+
+
+def test_sweep_end_to_end():
+    pars_df, scs = make_grid()
+    df = county_sweep.county_sim_parallel(pars_df, scs, n_workers=2, sim_fn=fake_scenario_sim, mp_context='spawn')
+    assert len(df) == 4*5
+    assert list(df.drop_duplicates(['county', 'mcv2'])[['county', 'mcv2']].itertuples(index=False, name=None)) == [
+        ('Kisumu', 0.0), ('Kisumu', 0.5), ('Turkana', 0.0), ('Turkana', 0.5)]  # Grid order
+    df1 = county_sweep.county_sim_parallel(pars_df, scs, n_workers=1, sim_fn=fake_scenario_sim)
+    pd.testing.assert_frame_equal(df, df1)  # Same seeds whatever the number of workers
+
+
+def failing_scenario_sim(county_row, sc_row, rand_seed=None):
+    if county_row['county'] == 'Turkana' and sc_row['mcv2'] == 0.5:
+        raise ValueError('Simulated failure')
+    return fake_scenario_sim(county_row, sc_row, rand_seed=rand_seed)
+
+
+def logging_scenario_sim(county_row, sc_row, rand_seed=None, log=None):
+    with open(log, 'a') as f:  # The jobs run in worker processes, so count them through a file
+        f.write(f"{county_row['county']},{sc_row['mcv2']}\n")
+    return fake_scenario_sim(county_row, sc_row, rand_seed=rand_seed)
+
+
+def test_sweep_resume_after_failure(tmp_path):
+    pars_df, scs = make_grid()
+    path = str(tmp_path/'sweep.db')
+    with pytest.raises(RuntimeError):
+        county_sweep.county_sim_parallel(pars_df, scs, n_workers=2, journal=path, sim_fn=failing_scenario_sim, mp_context='spawn')
+    with county_sweep.SweepJournal(path) as journal:
+        assert len(journal.done()) == 3  # The other jobs were still recorded
+
+    # Resuming only reruns the failed job, and gives the same results as a fresh sweep
+    log = tmp_path/'calls.txt'
+    sim_fn = functools.partial(logging_scenario_sim, log=str(log))
+    df = county_sweep.county_sim_parallel(pars_df, scs, n_workers=1, journal=path, sim_fn=sim_fn, mp_context='spawn')
+    assert log.read_text().splitlines() == ['Turkana,0.5']
+    fresh = county_sweep.county_sim_parallel(pars_df, scs, n_workers=1, sim_fn=fake_scenario_sim)
+    pd.testing.assert_frame_equal(df, fresh, check_dtype=False)
@@ -0,0 +1,31 @@
+import numpy as np
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx
+
+
+def make_sim(scheduled, n_agents=3000, rand_seed=1):
+    v1 = measles_vaccine(name='vax1', pars=dict(efficacy=0.85))
+    v2 = measles_vaccine(name='vax2', pars=dict(efficacy=0.99))
+    intv = [
+        measles_routine_vx(name='routine1', start_year=2020, product=v1, prob=0.95, dose='mcv1'),
+        measles_routine_vx(name='routine2', start_year=2020, product=v2, prob=0.95, dose='mcv2'),
+    ]
+    pars = dict(n_agents=n_agents, birth_rate=27.58, death_rate=7.8, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    sim = ss.Sim(pars=pars, start=2020, people=ss.People(n_agents=n_agents, age_data=pop_age),
+                 diseases=SEIR(scheduled=scheduled, init_prev=ss.bernoulli(p=0.01)), interventions=intv,
+                 rand_seed=rand_seed, n_years=5, dt=1/12, verbose=0)
+    return sim
+
+
+def test_scheduled_matches_scan():
+    """ Queuing the state transitions gives exactly the same run as scanning every agent """
+    scan = make_sim(scheduled=False).run()
+    queued = make_sim(scheduled=True).run()
+    assert scan.results.seir.cum_infections[-1] > 0
+    for key in scan.results.seir.keys():
+        np.testing.assert_array_equal(scan.results.seir[key], queued.results.seir[key], err_msg=key)
+    for state in ['susceptible', 'exposed', 'infected', 'recovered']:
+        np.testing.assert_array_equal(np.asarray(getattr(scan.diseases.seir, state).uids),
+                                      np.asarray(getattr(queued.diseases.seir, state).uids), err_msg=state)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import starsim as ss
+
+from major_improvement import SEIR, pop_age
+from vaccination import measles_vaccine, measles_routine_vx
+
+
+def make_sim(vaccines, n_agents=5000, dt=1/12):
+    intv = [measles_routine_vx(name=f'routine{i}', start_year=2020, product=vx, prob=0.95, dose=f'mcv{i}')
+            for i, vx in enumerate(vaccines, 1)]
+    pars = dict(n_agents=n_agents, birth_rate=27.58, death_rate=7.8, networks=ss.RandomNet(pars={'n_contacts': 10}))
+    sim = ss.Sim(pars=pars, start=2020, people=ss.People(n_agents=n_agents, age_data=pop_age),
+                 diseases=SEIR(init_prev=ss.bernoulli(p=0)), interventions=intv,
+                 rand_seed=1, n_years=5, dt=dt, verbose=0)
+    return sim
+
+
+def test_waning_matches_exponential():
+    """ With a refresh every timestep, rel_sus after one dose is exactly 1 - efficacy*exp(-waning*t) """
+    efficacy, waning, dt = 0.85, 0.2, 1/12
+    sim = make_sim([measles_vaccine(name='vax1', pars=dict(efficacy=efficacy, waning=waning, refresh=dt))], dt=dt).run()
+    doses = sim.people.doses
+    vaccinated = sim.people.auids[doses.n_doses[sim.people.auids] == 1]
+    assert len(vaccinated) > 100
+    t = (sim.ti - doses.ti_last_dose[vaccinated])*dt  # The last refresh was on the final timestep
+    assert t.max() > 4
+    np.testing.assert_allclose(sim.diseases.seir.rel_sus[vaccinated], 1 - efficacy*np.exp(-waning*t), rtol=1e-12)
+
+
+def test_refresh_mismatch():
+    vaccines = [
+        measles_vaccine(name='vax1', pars=dict(efficacy=0.85, waning=0.05, refresh=0.25)),
+        measles_vaccine(name='vax2', pars=dict(efficacy=0.99, waning=0.05, refresh=0.5)),
+    ]
+    with pytest.raises(ValueError, match='same refresh'):
+        make_sim(vaccines).initialize()
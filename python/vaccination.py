@@ -1,5 +1,179 @@
+from collections import defaultdict
+import numpy as np
 import starsim as ss
 import sciris as sc
+from age_schedule import AgeWindowIndex
+from adaptive import tick_dt, step_ticks, max_step_ticks, pop_buckets
+
+dose_windows = {1: (9/12, 12/12), 2: (18/12, 24/12)}  # Default routine age windows (years) for MCV1 and MCV2
+
+
+class AgentStates:
+    """
+    Per-agent states shared by several interventions or products, rather than
+    owned by one of them. The first one to need them adds them to the people as
+    ``sim.people.<name>``, via ``get()``; the others then use the same ones.
+    """
+    name = None
+
+    @property
+    def states(self):
+        return [arr for arr in self.__dict__.values() if isinstance(arr, ss.Arr)]
+
+    @classmethod
+    def get(cls, sim, **kwargs):
+        """ The sim's instance, created and added to the people if it doesn't exist yet """
+        obj = getattr(sim.people, cls.name, None)
+        if not isinstance(obj, cls):
+            obj = cls(**kwargs)
+            sim.people.add_module(obj)
+            setattr(sim.people, cls.name, obj)  # Replace the dict of states that add_module() stores
+        return obj
+
+
+class DoseRegistry(AgentStates):
+    """
+    Dose history of every agent, shared by all the vaccination interventions in a sim.
+
+    Columns are ``n_doses`` (doses of any kind received), ``ti_last_dose`` and
+    ``age_dose1``, ``age_dose2``, ... up to ``max_doses`` (the age at each dose).
+    It is available as ``sim.people.doses``.
+
+    Args:
+        max_doses (int): number of doses whose age is recorded (later doses are still counted)
+        compact (bool): use uint8 counts, int32 timesteps (largest int32 for "never") and float32 ages
+    """
+    name = 'doses'
+
+    def __init__(self, max_doses=3, compact=False):
+        self.max_doses = max_doses
+        if compact:
+            self.n_doses = ss.Arr('n_doses', dtype=np.uint8, default=0, nan=0, coerce=False)
+            self.ti_last_dose = ss.Arr('ti_last_dose', dtype=np.int32, nan=np.iinfo(np.int32).max, coerce=False)
+            self.age_doses = [ss.Arr(f'age_dose{d}', dtype=np.float32, nan=np.nan, coerce=False) for d in range(1, max_doses+1)]
+        else:
+            self.n_doses = ss.FloatArr('n_doses', default=0)
+            self.ti_last_dose = ss.FloatArr('ti_last_dose')
+            self.age_doses = [ss.FloatArr(f'age_dose{d}') for d in range(1, max_doses+1)]
+        for arr in self.age_doses:
+            setattr(self, arr.name, arr)
+        return
+
+    def eligible(self, uids, dose=None):
+        """ The agents among uids who are due the given dose (i.e. have had one fewer); any of them if dose is None """
+        if dose is None:
+            return uids
+        return uids[self.n_doses[uids] == dose - 1]
+
+    def record(self, uids, ti, age):
+        """ Record one more dose for each of the agents, given at timestep ti and the given ages """
+        n_doses = self.n_doses[uids] + 1
+        self.n_doses[uids] = n_doses
+        self.ti_last_dose[uids] = ti
+        for d, arr in enumerate(self.age_doses, 1):
+            is_dose = n_doses == d
+            arr[uids[is_dose]] = age[is_dose]
+        return
+
+
+class ImmunityKinetics(AgentStates):
+    """
+    Waning of vaccine protection, applied through the agents' ``rel_sus``.
+
+    After each dose, an agent's protection (1 - rel_sus) wanes exponentially at
+    the rate of the vaccine they last received. Instead of recomputing rel_sus
+    for every agent on every timestep, each vaccinated agent is queued to be
+    brought up to date every ``refresh`` years (and whenever they get another
+    dose), so each timestep only touches the agents that are due. Agents leave
+    the queue once their protection has fallen below ``min_protection``.
+
+    It is available as ``sim.people.immunity``. When it is created it also adds an
+    ImmunityRefresh connector to the sim, which brings the agents due an update
+    up to date each timestep, whichever disease the sim uses.
+
+    Args:
+        refresh (float): years between updates of an agent's rel_sus
+        min_protection (float): protection below which an agent is no longer updated
+    """
+    name = 'immunity'
+
+    def __init__(self, refresh=0.25, min_protection=1e-3):
+        self.refresh = refresh
+        self.min_protection = min_protection
+        self.protection = ss.FloatArr('protection', default=0)  # Protection just after the last dose
+        self.ti_protection = ss.FloatArr('ti_protection')  # Timestep of the last dose
+        self.waning = ss.FloatArr('waning', default=0)  # Waning rate (per year) of the last dose's vaccine
+        self.ti_refresh = ss.FloatArr('ti_refresh')  # Timestep of the next update
+        self.queue = defaultdict(list)  # Per-timestep buckets of uids due an update
+        return
+
+    @classmethod
+    def get(cls, sim, refresh=0.25, **kwargs):
+        """ As AgentStates.get(), but also adds the connector; all the vaccines in a sim must use the same refresh """
+        exists = isinstance(getattr(sim.people, cls.name, None), cls)
+        obj = super().get(sim, refresh=refresh, **kwargs)
+        if not exists:
+            connector = ImmunityRefresh()
+            connector.init_pre(sim)
+            sim.connectors.append(connector)
+        elif obj.refresh != refresh:
+            errormsg = f'Waning vaccines in the same sim must use the same refresh, but got {refresh} after {obj.refresh}'
+            raise ValueError(errormsg)
+        return obj
+
+    def current(self, sim, uids):
+        """ Protection of the agents at the current timestep """
+        elapsed = np.nan_to_num(sim.ti - self.ti_protection[uids])*tick_dt(sim)
+        return self.protection[uids]*np.exp(-self.waning[uids]*elapsed)
+
+    def schedule(self, sim, uids):
+        """ Queue the agents' next update, unless their protection has waned away """
+        uids = uids[(self.waning[uids] > 0) & (self.current(sim, uids) >= self.min_protection)]
+        ti_due = sim.ti + max(int(round(self.refresh/tick_dt(sim))), 1)
+        self.ti_refresh[uids] = ti_due
+        self.queue[ti_due].append(uids)
+        return
+
+    def record(self, sim, uids, waning):
+        """ Start waning from the agents' rel_sus just after a dose """
+        self.protection[uids] = 1 - sim.people.seir.rel_sus[uids]
+        self.ti_protection[uids] = sim.ti
+        self.waning[uids] = waning
+        self.schedule(sim, uids)
+        return
+
+    def refresh_rel_sus(self, sim, uids):
+        """ Set the agents' rel_sus from their current protection """
+        uids = uids[~np.isnan(self.ti_protection[uids])]
+        sim.people.seir.rel_sus[uids] = 1 - self.current(sim, uids)
+        return uids
+
+    def update(self, sim):
+        """ Bring the agents due this timestep up to date, and queue their next update """
+        due = pop_buckets(self.queue, sim)
+        if not due:
+            return
+        due = ss.uids(np.unique(np.concatenate(due)))
+        due = due[sim.people.alive[due] & (self.ti_refresh[due] <= sim.ti)]  # Skip those rescheduled by a later dose
+        self.refresh_rel_sus(sim, due)
+        self.schedule(sim, due)
+        return
+
+
+class ImmunityRefresh(ss.Connector):
+    """
+    Connector that updates the sim's ImmunityKinetics each timestep, after the
+    diseases' own updates and before any vaccines are given. Added by
+    ImmunityKinetics.get().
+    """
+    def __init__(self):
+        super().__init__(name='immunity_refresh')
+        return
+
+    def update(self):
+        self.sim.people.immunity.update(self.sim)
+        return
+
 
 class measlesIntervention(ss.Plugin):
     """
@@ -7,12 +181,20 @@ class measlesIntervention(ss.Plugin):
     
     The key method of the measlesIntervention is ``apply()``, which is called with the sim
     on each timestep.
+
+    Args:
+        dose (int/str): which dose this is, e.g. 1 or "mcv1" for agents with no doses yet;
+            None for a dose given regardless of earlier doses (e.g. a campaign; routine
+            vaccination treats None as MCV2)
+        window (tuple): youngest and oldest age (years) at which the dose is given;
+            by default the routine window for MCV1 or MCV2
     """
 
-    def __init__(self, eligibility=None, dose = None, *args, **kwargs):
+    def __init__(self, eligibility=None, dose = None, window=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.eligibility = eligibility
         self.dose = dose
+        self.window = window
         return
 
     def _parse_product(self, product):
@@ -46,71 +228,116 @@ class measlesIntervention(ss.Plugin):
         else:
             is_eligible = sim.people.auids # Everyone
         return is_eligible
-    # dummy function for checking dose
+
     def check_dose(self, sim):
-        if self.dose == "mcv1":
-            dose = "mcv1"
-        else:
-            dose = "mcv2"
-        return dose
+        """
+        Return the dose number (1 for MCV1, 2 for MCV2, ...), or None if given regardless of earlier doses
+        """
+        if self.dose is None or isinstance(self.dose, (int, np.integer)):
+            return self.dose
+        dose = str(self.dose).lower()
+        if dose.startswith('mcv') and dose[3:].isdigit():
+            return int(dose[3:])
+        errormsg = f'Cannot understand dose "{self.dose}"; please use a number or e.g. "mcv1"'
+        raise ValueError(errormsg)
+
+    def check_window(self, sim):
+        """
+        Return the (youngest, oldest) age in years at which the dose is given, or None for any age
+        """
+        if self.window is not None:
+            return self.window
+        dose = self.check_dose(sim)
+        if dose not in dose_windows:
+            errormsg = f'There is no default age window for dose {dose}; please give a window'
+            raise ValueError(errormsg)
+        return dose_windows[dose]
     
 class measlesBaseVaccination(measlesIntervention):
     """
     Base vaccination class for determining who will receive a vaccine.
+
+    Doses are recorded in the sim's shared DoseRegistry (``sim.people.doses``).
     """
-    def __init__(self, product=None, prob=None, label=None, **kwargs):
+    def __init__(self, product=None, prob=None, label=None, compact=False, **kwargs):
         super().__init__(**kwargs)
         self.prob = sc.promotetoarray(prob)
         self.label = label
         self._parse_product(product)
-        self.vaccinated = ss.BoolArr('vaccinated')
-        self.n_doses = ss.FloatArr('doses', default=0)
-        self.ti_vaccinated = ss.FloatArr('ti_vaccinated')
-        self.age_at_vaccination = ss.FloatArr('age_at_vaccination')  # New array to store age at vaccination
-        self.coverage_dist = ss.bernoulli(p=0)  # Placeholder
+        self.compact = compact  # Passed to the DoseRegistry, if this intervention creates it
+        self.coverage_dist = ss.bernoulli(p=0)  # Placeholder; seeded per agent, so paired sims share draws
+        self.age_index = None  # Agents in the dose's age window; created on the first timestep
         return
 
+    def init_pre(self, sim):
+        ss.Plugin.init_pre(self, sim)  # Not super(), which would reach the delivery's init_pre again
+        DoseRegistry.get(sim, compact=self.compact)
+        return
+
+    def step_timepoints(self, sim):
+        """ Indices of the delivery timepoints in this step (only this timestep, unless an AdaptiveSim takes a long step) """
+        return sc.findinds((self.timepoints >= sim.ti) & (self.timepoints < sim.ti + step_ticks(sim)))
+
+    def step_probs(self, sim, uids, inds):
+        """
+        Probability that each agent accepts the dose this step: over the delivery
+        timepoints in the step at which the agent is in the dose's age window
+        """
+        n_ticks = step_ticks(sim)
+        prob = np.zeros(n_ticks)
+        prob[(self.timepoints[inds] - sim.ti).astype(int)] = self.prob[inds]
+        window = self.check_window(sim)
+        if window is not None:
+            age = sim.people.age[uids][:, None] + np.arange(n_ticks)*tick_dt(sim)
+            prob = prob*((age >= window[0]) & (age <= window[1]))
+        return 1 - np.prod(1 - prob, axis=-1)
+
+    def find_in_window(self, sim):
+        """
+        Return the agents in the dose's age window. The age-window index is kept
+        up to date on every timestep, so that only agents currently in the
+        window need to be checked when doses are given. In an AdaptiveSim it
+        also holds the agents who will enter the window during a long step.
+        """
+        if self.age_index is None:
+            age_min, age_max = self.check_window(sim)
+            lead = (max_step_ticks(sim) - 1)*tick_dt(sim)
+            self.age_index = AgeWindowIndex(age_min - lead, age_max)
+        return self.age_index.update(sim)
+
     def apply(self, sim):
         """
         Deliver the diagnostics by finding who's eligible, finding who accepts, and applying the product.
         """
         accept_uids = np.array([])
-        if sim.ti in self.timepoints:
+        in_window = self.find_in_window(sim)
 
-            ti = sc.findinds(self.timepoints, sim.ti)[0]
-            prob = self.prob[ti]  # Get the proportion of people who will be tested this timestep
+        inds = self.step_timepoints(sim)
+        if len(inds):
+
+            # Get the proportion of people who will be tested this timestep
+            prob = self.prob[inds[0]]
             #is_eligible = self.check_eligibility(sim)  # Check eligibility
             #self.coverage_dist.set(p=prob)
             #accept_uids = self.coverage_dist.filter(is_eligible)
-            
-            check_dose = self.check_dose(sim)
-            if check_dose == "mcv1":
-                eligible_accept_uids = sim.people.auids[(sim.people.age >= 9/12) & (sim.people.age <= 12/12) & (sim.interventions.routine1.n_doses == 0)]
-            else:
-                eligible_accept_uids = sim.people.auids[
-                    (sim.people.age >= 18/12) & 
-                    (sim.people.age <= 24/12) & 
-                    (sim.interventions.routine1.n_doses == 1) &
-                    (sim.interventions.routine2.n_doses == 0) 
-                ]
-                
-            accept_uids = eligible_accept_uids[ss.bernoulli(p=prob, strict = False).rvs(eligible_accept_uids.shape)]
+
+            doses = sim.people.doses
+            eligible_accept_uids = doses.eligible(in_window, self.check_dose(sim))
+            if max_step_ticks(sim) > 1:
+                prob = self.step_probs(sim, eligible_accept_uids, inds)  # Depends on when each agent is in the window
+            self.coverage_dist.set(p=prob)
+            accept_uids = self.coverage_dist.filter(eligible_accept_uids)
 
             if len(accept_uids):
                 self.product.administer(sim.people, accept_uids)
-
-                # Update people's state and dates
-                self.vaccinated[accept_uids] = True
-                self.ti_vaccinated[accept_uids] = sim.ti
-                self.n_doses[accept_uids] += 1
-                
-                self.age_at_vaccination[accept_uids] = sim.people.age[accept_uids]
+                doses.record(accept_uids, sim.ti, sim.people.age[accept_uids])
 
         return accept_uids
 
 class measles_routine_vx(measlesBaseVaccination, ss.RoutineDelivery):
     """
     Routine vaccination - an instance of base vaccination combined with routine delivery.
+    A routine dose with no ``dose`` given is MCV2, as it always has been.
     See base classes for a description of input arguments.
     """
 
@@ -125,6 +352,45 @@ class measles_routine_vx(measlesBaseVaccination, ss.RoutineDelivery):
         ss.RoutineDelivery.init_pre(self, sim)  # Initialize this first, as it ensures that prob is interpolated properly
         measlesBaseVaccination.init_pre(self, sim)  # Initialize this next
 
+    def check_dose(self, sim):
+        """ As measlesIntervention.check_dose(), but MCV2 if no dose is given """
+        dose = super().check_dose(sim)
+        return 2 if dose is None else dose
+
+class measles_campaign_vx(measlesBaseVaccination, ss.CampaignDelivery):
+    """
+    Vaccination campaign (e.g. an SIA or catch-up) - an instance of base vaccination combined with campaign delivery.
+
+    By default everyone is eligible; use ``window`` to limit the ages (e.g.
+    ``window=(9/12, 5)``) and ``dose`` to limit it to agents due a given dose.
+    See base classes for a description of the other arguments.
+    """
+
+    def __init__(self, product=None, prob=None, years=None, interpolate=None, eligibility=None, **kwargs):
+        measlesBaseVaccination.__init__(self, product=product, eligibility=eligibility, years=years, **kwargs)  # Reaches CampaignDelivery.__init__() via super(), which needs the years
+        ss.CampaignDelivery.__init__(self, years=years, interpolate=interpolate, prob=prob)
+        return
+
+    def init_pre(self, sim):
+        ss.CampaignDelivery.init_pre(self, sim)
+        measlesBaseVaccination.init_pre(self, sim)
+
+    def check_window(self, sim):
+        """ Campaigns cover all ages unless given a window """
+        return self.window
+
+    def find_in_window(self, sim):
+        """ Campaigns are rare, so just check everyone's age on the campaign timesteps """
+        if not len(self.step_timepoints(sim)):
+            return ss.uids()
+        uids = sim.people.auids
+        window = self.check_window(sim)
+        if window is not None:
+            age = sim.people.age[uids]
+            lead = (step_ticks(sim) - 1)*tick_dt(sim)  # Agents who reach the window during a long step
+            uids = uids[(age >= window[0] - lead) & (age <= window[1])]
+        return uids
+
 class measles_vaccine(ss.Vx):
     """
     Create a vaccine product that affects the probability of infection.
@@ -135,23 +401,43 @@ class measles_vaccine(ss.Vx):
     that the efficacy is the probability that the vaccine "takes", in which case
     that person is 100% protected (and the remaining people are 0% protected).
     
+    With ``waning`` set, the protection then wanes exponentially, through the
+    sim's ImmunityKinetics.
+
     Args:
         efficacy (float): efficacy of the vaccine (0<=efficacy<=1)
         leaky (bool): see above
+        waning (float): rate (per year) at which protection wanes; None for lifelong protection
+        refresh (float): years between updates of waning protection (see ImmunityKinetics)
     """
     def __init__(self, pars=None, *args, **kwargs):
         super().__init__()
         self.default_pars(
             efficacy = 0.9,
-            leaky = True
+            leaky = True,
+            waning = None,
+            refresh = 0.25,
         )
         self.update_pars(pars, **kwargs)
+        self.take_dist = ss.bernoulli(p=0)  # Whether a non-leaky vaccine takes; set from the efficacy when used
+        return
+
+    def init_pre(self, sim):
+        super().init_pre(sim)
+        if self.pars.waning is not None:
+            ImmunityKinetics.get(sim, refresh=self.pars.refresh)
         return
 
     def administer(self, people, uids):        
+        immunity = getattr(people, 'immunity', None)
+        if immunity is not None:  # Start from the protection left over from earlier doses
+            immunity.refresh_rel_sus(people.sim, uids)
         if self.pars.leaky:
             people.seir.rel_sus[uids] *= 1-self.pars.efficacy
         else:
-            people.seir.rel_sus[uids] *= np.random.binomial(1, 1-self.pars.efficacy, len(uids))
+            self.take_dist.set(p=self.pars.efficacy)
+            people.seir.rel_sus[self.take_dist.filter(uids)] = 0
+        if immunity is not None:
+            immunity.record(people.sim, uids, self.pars.waning or 0)
         return
    